@@ -5,13 +5,29 @@ from chat_message import ChatMessage
 
 from dotenv import load_dotenv
 from langchain_teddynote import logging
-from layout_parser import graph_document_ai, GraphState
-
-
-from constants import PROGRESS_MESSAGE_GRAPH_NODES
+from layout_parser import (
+    graph_document_ai,
+    stream_document_ai,
+    incremental_document_ai,
+    merge_graph_states,
+    GraphState,
+)
+
+
+from constants import (
+    PROGRESS_MESSAGE_GRAPH_NODES,
+    LAYOUT_MAX_CONCURRENCY,
+    SPLIT_BATCH_SIZE,
+    SPLIT_TARGET_BYTES,
+    CROP_FORMAT,
+    CROP_QUALITY,
+    CROP_MAX_DIMENSION,
+    IMAGE_PACKING_ENABLED,
+    LOCAL_PARSE_ENABLED,
+)
 from output import clean_cache_files
 from document_utils import download_files, check_file_type
-from retriever import create_ensemble_retriever
+from retriever import get_file_index_key, create_ensemble_retriever
 from chat_utils import create_chain
 
 # Load API KEY information
@@ -65,6 +81,25 @@ with st.sidebar:
     translate_lang = st.selectbox("Translate", ["Korean", "English", "German"], index=0)
     # Translate toggle
     translate_toggle = st.checkbox("Enable Translation", value=False)
+    # Encoding of the cropped figures and tables
+    crop_formats = ["png", "webp", "jpeg"]
+    crop_format = st.selectbox(
+        "Crop format", crop_formats, index=crop_formats.index(CROP_FORMAT)
+    )
+    # Packing toggle (summarize the small figures of a page in one request)
+    pack_toggle = st.checkbox("Pack small figures", value=IMAGE_PACKING_ENABLED)
+    # Streaming toggle (process the document chunk by chunk)
+    stream_toggle = st.checkbox("Streaming mode", value=False)
+    # Incremental toggle (reprocess only the pages changed since the last revision)
+    incremental_toggle = st.checkbox("Incremental mode (PDF)", value=False)
+    # Local parsing toggle (text-only PDF pages are parsed without the API)
+    local_parse_toggle = st.checkbox(
+        "Parse text-only pages locally (PDF)", value=LOCAL_PARSE_ENABLED
+    )
+    revision_key = st.text_input(
+        "Document ID",
+        help="Shared by the revisions of a document (default: file name)",
+    )
     # Create AI Translate & Summary button
     start_btn = st.button("Document AI")
 
@@ -121,6 +156,34 @@ if uploaded_files:
     uploaded_files = None
 
 
+def process_stream(outputs, state, progress_bar, status_container):
+    # Display the page summaries as soon as their chunk is finished
+    message_dict = PROGRESS_MESSAGE_GRAPH_NODES
+    total_chunks = 0
+    completed_chunks = 0
+
+    for output in outputs:
+        for key, value in output.items():
+            merge_graph_states(state, value)
+
+            if key == "process_chunk":
+                completed_chunks += 1
+                for page_num, summary in value.get("texts_summary", {}).items():
+                    with st.expander(f"Page {page_num + 1}"):
+                        st.markdown(summary)
+            elif key in ("split_pdf", "merge_image"):
+                # Number of chunks is known once the document is split
+                if "page_ranges" in value:
+                    chunks = value["page_ranges"]
+                else:
+                    chunks = value["split_filepaths"]
+                total_chunks = len(chunks)
+
+            progress = completed_chunks / max(total_chunks, 1)
+            progress_bar.progress(progress)
+            status_container.text(f"{int(progress * 100)}% - {message_dict[key]}")
+
+
 def process_graph(file_paths):
     # Create container for progress display
     progress_bar = st.progress(0)
@@ -139,28 +202,43 @@ def process_graph(file_paths):
 
     # Create graph
     message_dict = PROGRESS_MESSAGE_GRAPH_NODES
-    graph = graph_document_ai(translate_toggle)
     inputs = {
         "filepath": file_paths,
         "filetype": filetype,
-        "batch_size": 10,
+        "batch_size": SPLIT_BATCH_SIZE,
+        "split_target_bytes": SPLIT_TARGET_BYTES,
+        "max_concurrency": LAYOUT_MAX_CONCURRENCY,
+        "crop_format": crop_format,
+        "crop_quality": CROP_QUALITY,
+        "crop_max_dimension": CROP_MAX_DIMENSION,
+        "pack_images": pack_toggle,
+        "local_parse": local_parse_toggle,
         "translate_lang": translate_lang,
         "translate_toggle": translate_toggle,
     }
 
-    total_nodes = len(graph.nodes)
+    if incremental_toggle and filetype == "pdf":
+        document_id = revision_key or os.path.splitext(os.path.basename(file_paths))[0]
+        outputs = incremental_document_ai(inputs, document_id)
+        process_stream(outputs, state, progress_bar, status_container)
+    elif stream_toggle:
+        outputs = stream_document_ai(inputs)
+        process_stream(outputs, state, progress_bar, status_container)
+    else:
+        graph = graph_document_ai(translate_toggle)
+        total_nodes = len(graph.nodes)
 
-    for i, output in enumerate(graph.stream(inputs)):
-        progress = (i + 1) / total_nodes
-        progress_bar.progress(progress)
+        for i, output in enumerate(graph.stream(inputs)):
+            progress = (i + 1) / total_nodes
+            progress_bar.progress(progress)
 
-        # Calculate progress percentage
-        progress_percentage = int(progress * 100)
+            # Calculate progress percentage
+            progress_percentage = int(progress * 100)
 
-        for key, value in output.items():
-            # Display message for the next step
-            status_container.text(f"{progress_percentage}% - {message_dict[key]}")
-            state.update(value)
+            for key, value in output.items():
+                # Display message for the next step
+                status_container.text(f"{progress_percentage}% - {message_dict[key]}")
+                state.update(value)
 
     # Set progress bar to 100% and display "Finished!" message in green
     progress_bar.progress(1.0)
@@ -174,14 +252,17 @@ if start_btn:
     if file_paths is None:
         st.error("Please upload a file first.")
     else:
+        # Key of the retriever saved for the same file
+        index_key = get_file_index_key(file_paths)
         # Create graph
         state = process_graph(file_paths)
         # Download file
         download_files(file_paths[0], state, translate_toggle)
+
+        # Create document retriever, or load the one saved for the same file
+        retriever = create_ensemble_retriever(state["documents"], index_key)
         st.session_state["filepath"] = None
 
-        # Create document retriever
-        retriever = create_ensemble_retriever(state["documents"])
         # Save document retriever
         st.session_state["retriever"] = retriever
         # Create chain
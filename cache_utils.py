@@ -0,0 +1,449 @@
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from constants import (
+    LAYOUT_CACHE_DIR,
+    LAYOUT_CACHE_MAX_BYTES,
+    LLM_CACHE_PATH,
+    LLM_CACHE_TTL_SECONDS,
+    LLM_CACHE_MAX_BYTES,
+    EMBEDDING_CACHE_DIR,
+)
+
+
+class LayoutCache:
+    def __init__(self, cache_dir=LAYOUT_CACHE_DIR, max_bytes=LAYOUT_CACHE_MAX_BYTES):
+        """
+        Constructor for LayoutCache class
+
+        Layout analysis responses are stored as JSON files named after the hash of
+        the analyzed document. The least recently used entries are evicted
+        when the total size of the cache exceeds max_bytes.
+
+        :param cache_dir: Directory to store the cached responses
+        :param max_bytes: Maximum total size of the cache in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(document, output_formats):
+        """
+        Method to create a cache key from the document bytes and output formats
+
+        :param document: Bytes of the uploaded document, or other bytes
+            identifying it (e.g. source file hash and page numbers)
+        :param output_formats: Output formats requested from the API
+        :return: Hex digest used as the cache key
+        """
+        digest = hashlib.sha256(document)
+        digest.update(output_formats.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key, output_file):
+        """
+        Method to copy a cached response to a file
+
+        :param key: Cache key
+        :param output_file: Path to write the cached response to
+        :return: True if the key was cached, False otherwise
+        """
+        path = self._path(key)
+        with self._lock:
+            try:
+                shutil.copyfile(path, output_file)
+            except FileNotFoundError:
+                self.misses += 1
+                return False
+
+            # Touch the file so that it is the most recently used entry
+            os.utime(path)
+            self.hits += 1
+        return True
+
+    def put(self, key, input_file):
+        """
+        Method to store a response file in the cache
+
+        :param key: Cache key
+        :param input_file: Path to the response file to store
+        """
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        shutil.copyfile(input_file, tmp_path)
+        with self._lock:
+            os.replace(tmp_path, path)
+            self._evict()
+
+    def _evict(self):
+        # Collect cache entries ordered from the least recently used
+        entries = []
+        total_size = 0
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, filename)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_bytes:
+                break
+            os.remove(path)
+            total_size -= size
+
+    def stats(self):
+        """
+        Method to get the cache counters
+
+        :return: Dictionary with hits, misses and hit rate
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class LLMCache:
+    def __init__(
+        self,
+        path=LLM_CACHE_PATH,
+        ttl_seconds=LLM_CACHE_TTL_SECONDS,
+        max_bytes=LLM_CACHE_MAX_BYTES,
+    ):
+        """
+        Constructor for LLMCache class
+
+        LLM outputs are stored in a SQLite database. Entries older than ttl_seconds
+        are ignored and removed, and the least recently used entries are evicted
+        when the total size of the stored outputs exceeds max_bytes.
+
+        :param path: Path to the SQLite database file
+        :param ttl_seconds: Time to live of an entry in seconds
+        :param max_bytes: Maximum total size of the stored outputs in bytes
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS llm_cache_accessed_at "
+                "ON llm_cache (accessed_at)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        # Commit the transaction and close the connection after each operation
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(model, prompt, language, *inputs):
+        """
+        Method to create a cache key for an LLM call
+
+        :param model: Model name
+        :param prompt: Prompt template
+        :param language: Output language
+        :param inputs: Input texts or bytes (page text, image bytes, ...)
+        :return: Hex digest used as the cache key
+        """
+        digest = hashlib.sha256()
+        for part in (model, prompt, language, *inputs):
+            if isinstance(part, str):
+                part = part.encode("utf-8")
+            # Prefix every part with its length so that parts cannot run together
+            digest.update(len(part).to_bytes(8, "big"))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Method to get a cached LLM output
+
+        :param key: Cache key
+        :return: Cached output, or None if the key is not cached or expired
+        """
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM llm_cache WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            conn.execute(
+                "UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+        return row[0]
+
+    def put(self, key, value):
+        """
+        Method to store an LLM output in the cache
+
+        :param key: Cache key
+        :param value: LLM output text
+        """
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        # Remove expired entries
+        conn.execute(
+            "DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+        )
+
+        # Remove the least recently used entries until the cache fits in max_bytes
+        (total_size,) = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM llm_cache"
+        ).fetchone()
+        if total_size <= self.max_bytes:
+            return
+
+        evicted_keys = []
+        for key, size in conn.execute(
+            "SELECT key, size FROM llm_cache ORDER BY accessed_at"
+        ).fetchall():
+            if total_size <= self.max_bytes:
+                break
+            evicted_keys.append((key,))
+            total_size -= size
+        conn.executemany("DELETE FROM llm_cache WHERE key = ?", evicted_keys)
+
+    def stats(self):
+        """
+        Method to get the cache counters
+
+        :return: Dictionary with hits, misses and hit rate
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir=EMBEDDING_CACHE_DIR):
+        """
+        Constructor for EmbeddingCache class
+
+        The vectors of each model are appended to a float32 file that is read
+        through a memory map, and a SQLite index maps the text hash to the row
+        of its vector. The number of rows of each model is only updated after the
+        vectors are written, so a vector file is never read past its last
+        complete row.
+
+        :param cache_dir: Directory to store the vector files and the index
+        """
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, "index.sqlite")
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._vectors = dict()  # model -> memory map of its vector file
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS models (
+                    model TEXT PRIMARY KEY,
+                    dim INTEGER NOT NULL,
+                    rows INTEGER NOT NULL
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    row INTEGER NOT NULL,
+                    PRIMARY KEY (model, key)
+                )"""
+            )
+
+    @contextmanager
+    def _connect(self):
+        # Commit the transaction and close the connection after each operation
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(text):
+        """
+        Method to create a cache key from a text
+
+        :param text: Embedded text
+        :return: Hex digest used as the cache key
+        """
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, model):
+        model_hash = hashlib.sha256(model.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{model_hash}.f32")
+
+    def _memmap(self, model, dim, rows):
+        # Open the memory map again only when the file has new rows
+        vectors = self._vectors.get(model)
+        if vectors is None or len(vectors) < rows:
+            vectors = np.memmap(
+                self._path(model), dtype=np.float32, mode="r", shape=(rows, dim)
+            )
+            self._vectors[model] = vectors
+        return vectors
+
+    def get(self, model, keys):
+        """
+        Method to get cached vectors
+
+        :param model: Embedding model name
+        :param keys: List of cache keys
+        :return: List of vectors, None for the keys that are not cached
+        """
+        if not keys:
+            return []
+
+        with self._lock, self._connect() as conn:
+            model_row = conn.execute(
+                "SELECT dim, rows FROM models WHERE model = ?", (model,)
+            ).fetchone()
+            if model_row is None:
+                self.misses += len(keys)
+                return [None] * len(keys)
+
+            rows = dict()
+            unique_keys = list(set(keys))
+            # Stay below the maximum number of SQLite parameters
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start : start + 500]
+                rows.update(
+                    conn.execute(
+                        "SELECT key, row FROM embeddings WHERE model = ? "
+                        f"AND key IN ({', '.join('?' * len(batch))})",
+                        (model, *batch),
+                    ).fetchall()
+                )
+            vectors = self._memmap(model, *model_row)
+
+            results = [
+                vectors[rows[key]].tolist() if key in rows else None for key in keys
+            ]
+            found = sum(result is not None for result in results)
+            self.hits += found
+            self.misses += len(keys) - found
+        return results
+
+    def put(self, model, keys, vectors):
+        """
+        Method to store vectors in the cache
+
+        :param model: Embedding model name
+        :param keys: List of cache keys
+        :param vectors: List of vectors in the same order as keys
+        """
+        if not keys:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+
+        with self._lock, self._connect() as conn:
+            # Serialize the writers of all processes
+            conn.execute("BEGIN IMMEDIATE")
+            model_row = conn.execute(
+                "SELECT dim, rows FROM models WHERE model = ?", (model,)
+            ).fetchone()
+            if model_row is None:
+                dim, rows = vectors.shape[1], 0
+                conn.execute("INSERT INTO models VALUES (?, ?, 0)", (model, dim))
+            else:
+                dim, rows = model_row
+            if vectors.shape[1] != dim:
+                raise ValueError(
+                    f"Embedding dimension {vectors.shape[1]} does not match {dim}"
+                )
+
+            # Overwrite anything written after the last complete row
+            path = self._path(model)
+            with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                f.seek(rows * dim * vectors.itemsize)
+                f.write(vectors.tobytes())
+                f.truncate()
+
+            conn.executemany(
+                "INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)",
+                [(model, key, rows + i) for i, key in enumerate(keys)],
+            )
+            conn.execute(
+                "UPDATE models SET rows = ? WHERE model = ?",
+                (rows + len(keys), model),
+            )
+
+    def stats(self):
+        """
+        Method to get the cache counters
+
+        :return: Dictionary with hits, misses and hit rate
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# Shared layout cache used by every DocumentParser
+layout_cache = LayoutCache()
+
+# Shared cache of translations and summaries
+llm_cache = LLMCache()
+
+# Shared cache of the embedding vectors of all embedding models
+embedding_cache = EmbeddingCache()
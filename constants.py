@@ -10,6 +10,90 @@ DB_PATH = f"{ROOT_DIR}/DB"
 # Number of ingestion threads
 INGEST_THREADS = os.cpu_count() or 8
 
+# Splitting of PDF files into chunks for the layout analysis API
+SPLIT_BATCH_SIZE = 10  # maximum number of pages per chunk
+SPLIT_TARGET_BYTES = 8 * 1024 * 1024  # target upload size per chunk
+SPLIT_MAX_IMAGES = 50  # maximum number of images per chunk
+
+# Local parsing of text-only PDF pages (skips the layout analysis API)
+# Off by default: a text layer does not rule out charts or borderless tables
+LOCAL_PARSE_ENABLED = False
+LOCAL_PARSE_MAX_DRAWINGS = 20  # more vector drawings suggest figures or tables
+LOCAL_PARSE_MAX_DRAWING_AREA = 0.01  # largest drawing, as a fraction of the page
+LOCAL_PARSE_HEADING_SCALE = 1.3  # font size ratio to the body text for headings
+
+# Number of split PDF chunks sent to the layout analysis API at the same time
+LAYOUT_MAX_CONCURRENCY = int(os.environ.get("LAYOUT_MAX_CONCURRENCY", 4))
+
+# Layout analysis response cache
+LAYOUT_CACHE_DIR = ".cache/layout"
+LAYOUT_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # 1 GB
+
+# Size of the parts read from layout analysis responses and result files
+LAYOUT_STREAM_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+# Resolution of the cropped PDF regions per element category
+CROP_DPI = {
+    "figure": 300,
+    "table": 300,
+}
+
+# Boxes of the same category on a page with at least this IoU are cropped once
+CROP_MERGE_IOU = 0.9
+# PDF pages with at least this many crops are rendered once and cropped in memory
+CROP_PAGE_RENDER_MIN_ELEMENTS = 8
+
+# Encoding of the cropped images ("png", "webp" or "jpeg")
+CROP_FORMAT = os.environ.get("CROP_FORMAT", "png")
+CROP_QUALITY = int(os.environ.get("CROP_QUALITY", 85))  # webp/jpeg quality
+# Longest side of the cropped images in pixels, vision models downscale larger images
+CROP_MAX_DIMENSION = int(os.environ.get("CROP_MAX_DIMENSION", 2048))
+
+# Figures whose difference hashes differ in at most this many bits are summarized
+# once if their pixels also match (-1 disables the perceptual matching, identical
+# crops are always merged). Off by default: blank regions and short callouts
+# share a hash.
+CROP_DHASH_MAX_DISTANCE = int(os.environ.get("CROP_DHASH_MAX_DISTANCE", -1))
+# Pixel check of perceptual matches: aspect ratio difference and mean grayscale
+# difference (0-255) at the size of the smaller crop
+CROP_MATCH_MAX_ASPECT_DIFFERENCE = 0.02
+CROP_MATCH_MAX_PIXEL_DIFFERENCE = 2.0
+
+# Small figures of the same page summarized together in one vision request
+IMAGE_PACKING_ENABLED = False
+IMAGE_PACK_MAX_IMAGES = 4  # figures per request
+IMAGE_PACK_MAX_PIXELS = 512 * 512  # figures larger than this are sent alone
+
+# LLM models used by the Document AI pipeline
+OPENAI_MODEL = "gpt-4o-mini"
+OLLAMA_MODEL = "gemma2-27B:latest"
+
+# LLM request scheduling
+LLM_MAX_IN_FLIGHT = int(os.environ.get("LLM_MAX_IN_FLIGHT", 16))
+LLM_RATE_LIMITS = {  # requests per minute
+    OPENAI_MODEL: int(os.environ.get("OPENAI_RPM", 500)),
+}
+# Parallel request slots of the Ollama server (same as its OLLAMA_NUM_PARALLEL).
+# One extra request is kept queued on the server so that a slot never idles
+# while the next request is sent.
+OLLAMA_NUM_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", 4))
+OLLAMA_QUEUED_REQUESTS = int(os.environ.get("OLLAMA_QUEUED_REQUESTS", 1))
+LLM_MODEL_MAX_IN_FLIGHT = {  # concurrent calls per model, within LLM_MAX_IN_FLIGHT
+    OLLAMA_MODEL: OLLAMA_NUM_PARALLEL + OLLAMA_QUEUED_REQUESTS,
+}
+LLM_MAX_RETRIES = 5
+LLM_BACKOFF_SECONDS = 1.0
+
+# Translation and summary cache
+LLM_CACHE_PATH = ".cache/llm/llm_cache.sqlite"
+LLM_CACHE_TTL_SECONDS = 30 * 24 * 60 * 60  # 30 days
+LLM_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 512 MB
+
+# Incremental processing of document revisions
+FINGERPRINT_DPI = 36  # resolution of the page render used for fingerprints
+REVISION_DIR = ".cache/revisions"
+REVISION_MAX_BYTES = 512 * 1024 * 1024  # 512 MB, least recently used are deleted
+
 # Document loader map
 DOCUMENT_MAP = {
     ".pdf": PyMuPDFLoader,
@@ -26,6 +110,7 @@ PROGRESS_MESSAGE_GRAPH_NODES = {
     "extract_page_numbers": "Extracting page numbers..",
     "crop_image": "Cropping image..",
     "crop_table": "Cropping table..",
+    "crop_elements": "Cropping images and tables..",
     "extract_page_text": "Extracting page text..",
     "translate_text": "Translating text..",
     "create_text_summary": "Creating text summary..",
@@ -34,6 +119,8 @@ PROGRESS_MESSAGE_GRAPH_NODES = {
     "create_image_summary": "Creating image summary..",
     "create_table_summary": "Creating table summary..",
     "clean_up": "Cleaning up..",
+    "process_chunk": "Processing pages..",
+    "reuse_pages": "Reusing unchanged pages..",
 }
 
 # Output directory
@@ -41,3 +128,22 @@ OUTPUT_DIR = ".cache/output"
 
 # Embedding model
 EMBEDDING_MODEL = "intfloat/multilingual-e5-large-instruct"
+# Device of the embedding model (default: first available of cuda, mps and cpu)
+EMBEDDING_DEVICE = os.environ.get("EMBEDDING_DEVICE")
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 32))
+
+# Embedding cache (text hash and model name -> vector)
+EMBEDDING_CACHE_DIR = ".cache/embeddings"
+
+# Vector store directory of the saved retrievers
+FAISS_DB_DIR = "faiss_db"
+# Prefix of the retriever indexes of processed documents, followed by their hash
+DOCUMENT_INDEX_PREFIX = "document_"
+# Number of document retrievers kept, the least recently used are deleted
+DOCUMENT_INDEX_MAX_COUNT = int(os.environ.get("DOCUMENT_INDEX_MAX_COUNT", 50))
+
+# FAISS index variant of the ESRS/RBA stores loaded by the chat pages
+# ("flat" is the index saved by FAISS.from_documents, see faiss_index.py)
+FAISS_INDEX_VARIANT = os.environ.get("FAISS_INDEX_VARIANT", "flat")
+FAISS_NPROBE = int(os.environ.get("FAISS_NPROBE", 16))  # IVF lists searched
+FAISS_EF_SEARCH = int(os.environ.get("FAISS_EF_SEARCH", 64))  # HNSW search depth
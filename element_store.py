@@ -0,0 +1,284 @@
+from array import array
+from collections.abc import Mapping
+
+import numpy as np
+
+
+# Element list keys of a page and the categories they contain.
+# Elements of other categories are text elements.
+ELEMENT_TYPES = {
+    "image_elements": ("figure",),
+    "table_elements": ("table",),
+    "chart_elements": ("chart",),
+    "equation_elements": ("equation",),
+    "index_elements": ("index",),
+}
+TEXT_ELEMENT_TYPE = "text_elements"
+
+
+class Element:
+    """
+    Read-only view of an element stored in an ElementStore
+
+    Supports the same keys as the layout analysis result ("id", "page",
+    "category", "coordinates", "content") so it can be used like the raw element.
+    """
+
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store, index):
+        self._store = store
+        self._index = index
+
+    @property
+    def id(self):
+        return self._store.ids[self._index]
+
+    @property
+    def page(self):
+        return self._store.pages[self._index]
+
+    @property
+    def category(self):
+        return self._store.categories[self._store.category_codes[self._index]]
+
+    @property
+    def bbox(self):
+        """Normalized bounding box (x1, y1, x2, y2)"""
+        start = self._index * 4
+        return tuple(self._store.bboxes[start : start + 4])
+
+    @property
+    def coordinates(self):
+        """Corner points of the bounding box, like the layout analysis result"""
+        x1, y1, x2, y2 = self.bbox
+        return [
+            {"x": x1, "y": y1},
+            {"x": x2, "y": y1},
+            {"x": x2, "y": y2},
+            {"x": x1, "y": y2},
+        ]
+
+    @property
+    def content(self):
+        html, markdown, text = self._store.contents[
+            self._store.content_indices[self._index]
+        ]
+        return {"html": html, "markdown": markdown, "text": text}
+
+    def __getitem__(self, key):
+        if key not in ("id", "page", "category", "coordinates", "content"):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __repr__(self):
+        return f"Element(id={self.id}, page={self.page}, category={self.category!r})"
+
+
+class PageElements(Mapping):
+    """
+    Elements of a single page grouped by element type
+
+    Keys are the element list keys ("image_elements", "text_elements", ...)
+    and "elements" for all elements of the page in reading order.
+    """
+
+    __slots__ = ("_store", "_page")
+
+    def __init__(self, store, page):
+        self._store = store
+        self._page = page
+
+    def __getitem__(self, key):
+        indices = self._store.page_indices[self._page]
+        if key == "elements":
+            return [Element(self._store, index) for index in indices]
+        if key not in self._store.type_codes:
+            raise KeyError(key)
+        codes = self._store.type_codes[key]
+        return [
+            Element(self._store, index)
+            for index in indices
+            if self._store.category_codes[index] in codes
+        ]
+
+    def __iter__(self):
+        return iter([*ELEMENT_TYPES, TEXT_ELEMENT_TYPE, "elements"])
+
+    def __len__(self):
+        return len(ELEMENT_TYPES) + 2
+
+
+class ElementStore(Mapping):
+    """
+    Compact store of the layout elements of a document
+
+    Element attributes are kept in typed array columns (ID, page, category code,
+    bounding box) and the html/markdown/text contents are stored once per
+    distinct content, so repeated headers and footers share their strings.
+    The store is a mapping of page number to PageElements.
+    """
+
+    def __init__(self):
+        self.ids = array("q")
+        self.pages = array("i")
+        self.category_codes = array("B")
+        self.bboxes = array("f")
+        self.content_indices = array("i")
+        self.categories = []  # category name by category code
+        self.contents = []  # (html, markdown, text) by content index
+        self.page_indices = dict()  # page number -> element indices
+        self.type_codes = {
+            element_type: set() for element_type in [*ELEMENT_TYPES, TEXT_ELEMENT_TYPE]
+        }
+        self._category_index = dict()
+        self._content_index = dict()
+
+    def _category_code(self, category):
+        if category not in self._category_index:
+            code = len(self.categories)
+            self.categories.append(category)
+            self._category_index[category] = code
+
+            # Register the code for the element type of the category
+            for element_type, categories in ELEMENT_TYPES.items():
+                if category in categories:
+                    self.type_codes[element_type].add(code)
+                    break
+            else:
+                self.type_codes[TEXT_ELEMENT_TYPE].add(code)
+        return self._category_index[category]
+
+    def _content_code(self, content):
+        if content not in self._content_index:
+            self._content_index[content] = len(self.contents)
+            self.contents.append(content)
+        return self._content_index[content]
+
+    def append(self, element_id, page, category, bbox, html="", markdown="", text=""):
+        """
+        Method to add an element to the store
+
+        :param element_id: Unique element ID
+        :param page: Page number of the element
+        :param category: Element category (e.g. "figure", "table", "paragraph")
+        :param bbox: Normalized bounding box (x1, y1, x2, y2)
+        :param html: HTML content
+        :param markdown: Markdown content
+        :param text: Text content
+        :return: Element view of the added element
+        """
+        index = len(self.ids)
+        self.ids.append(element_id)
+        self.pages.append(page)
+        self.category_codes.append(self._category_code(category))
+        self.bboxes.extend(bbox)
+        self.content_indices.append(self._content_code((html, markdown, text)))
+        self.page_indices.setdefault(page, array("i")).append(index)
+        return Element(self, index)
+
+    def append_raw(self, element_id, page, element):
+        """
+        Method to add an element of the layout analysis result
+
+        :param element_id: Unique element ID
+        :param page: Page number of the element in the document
+        :param element: Element dictionary of the layout analysis result
+        :return: Element view of the added element
+        """
+        x_values = [coord["x"] for coord in element["coordinates"]]
+        y_values = [coord["y"] for coord in element["coordinates"]]
+        content = element.get("content", {})
+        return self.append(
+            element_id,
+            page,
+            element["category"],
+            (min(x_values), min(y_values), max(x_values), max(y_values)),
+            content.get("html", ""),
+            content.get("markdown", ""),
+            content.get("text", ""),
+        )
+
+    def copy_page(self, other, page, new_page=None):
+        """
+        Method to copy the elements of a page from another store
+
+        :param other: ElementStore to copy from
+        :param page: Page number in the other store
+        :param new_page: Page number in this store (default: same page number)
+        """
+        new_page = page if new_page is None else new_page
+        for element in other[page]["elements"]:
+            html, markdown, text = other.contents[other.content_indices[element._index]]
+            self.append(
+                element.id,
+                new_page,
+                element.category,
+                element.bbox,
+                html,
+                markdown,
+                text,
+            )
+
+    def update(self, other):
+        """
+        Method to add all elements of another store
+
+        :param other: ElementStore to add
+        """
+        for page in other:
+            self.copy_page(other, page)
+
+    def elements(self, page=None, category=None):
+        """
+        Method to get the elements of a page and/or category
+
+        :param page: Page number (default: all pages)
+        :param category: Element category (default: all categories)
+        :return: List of Element views
+        """
+        if page is None:
+            indices = [index for page in self for index in self.page_indices[page]]
+        else:
+            indices = self.page_indices.get(page, [])
+        if category is not None:
+            code = self._category_index.get(category)
+            indices = [index for index in indices if self.category_codes[index] == code]
+        return [Element(self, index) for index in indices]
+
+    def bbox_array(self, elements):
+        """
+        Method to get the bounding boxes of elements as an array
+
+        :param elements: List of Element views of this store
+        :return: Array of normalized boxes (x1, y1, x2, y2) with shape (n, 4)
+        """
+        indices = [element._index for element in elements]
+        # The fancy indexing copies the rows, so the column buffer is not kept
+        return np.frombuffer(self.bboxes, dtype=np.float32).reshape(-1, 4)[indices]
+
+    def __getitem__(self, page):
+        if page not in self.page_indices:
+            raise KeyError(page)
+        return PageElements(self, page)
+
+    def __iter__(self):
+        return iter(sorted(self.page_indices))
+
+    def __contains__(self, page):
+        return page in self.page_indices
+
+    def __len__(self):
+        return len(self.page_indices)
+
+    def __getstate__(self):
+        # The lookup dictionaries are rebuilt when the store is loaded
+        state = self.__dict__.copy()
+        del state["_content_index"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._content_index = {
+            content: index for index, content in enumerate(self.contents)
+        }
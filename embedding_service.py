@@ -0,0 +1,168 @@
+import threading
+
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+
+from constants import EMBEDDING_MODEL, EMBEDDING_DEVICE, EMBEDDING_BATCH_SIZE
+from cache_utils import embedding_cache
+
+
+def select_device(device=EMBEDDING_DEVICE):
+    """
+    Select the device of the embedding model
+
+    :param device: Device to use (e.g. "cuda:1", "cpu"), or None to select the
+        first available of cuda, mps and cpu
+    :return: Device name
+    """
+    if device:
+        return device
+
+    import torch
+
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+class EmbeddingService(Embeddings):
+    def __init__(
+        self, model_name=EMBEDDING_MODEL, device=None, batch_size=EMBEDDING_BATCH_SIZE
+    ):
+        """
+        Constructor for EmbeddingService class
+
+        Shared HuggingFace embedding model. The model is loaded once, on first use
+        or by warm_up, and the embedding calls of all threads are serialized so
+        that the model runs one batch at a time.
+
+        :param model_name: HuggingFace model name
+        :param device: Device of the model (default: selected by select_device)
+        :param batch_size: Number of texts encoded at once
+        """
+        self.model_name = model_name
+        self.device = device
+        self.batch_size = batch_size
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+        self._warm_up_thread = None
+
+    @property
+    def model(self):
+        """Loaded HuggingFaceEmbeddings model"""
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    self.device = select_device(self.device)
+                    self._model = HuggingFaceEmbeddings(
+                        model_name=self.model_name,
+                        model_kwargs={"device": self.device},
+                        encode_kwargs={
+                            "normalize_embeddings": True,
+                            "batch_size": self.batch_size,
+                        },
+                    )
+        return self._model
+
+    def embed_documents(self, texts):
+        """
+        Method to embed a list of texts in batches
+
+        :param texts: List of texts
+        :return: List of embedding vectors
+        """
+        model = self.model
+        with self._encode_lock:
+            return model.embed_documents(list(texts))
+
+    def embed_query(self, text):
+        """
+        Method to embed a query
+
+        :param text: Query text
+        :return: Embedding vector
+        """
+        model = self.model
+        with self._encode_lock:
+            return model.embed_query(text)
+
+    def warm_up(self, background=True):
+        """
+        Method to load the model and run a first embedding
+
+        Only the first call starts the warm-up, later calls return immediately.
+
+        :param background: Load the model in a background thread
+        """
+        with self._load_lock:
+            if self._warm_up_thread is not None:
+                return
+            self._warm_up_thread = threading.Thread(
+                target=self.embed_query, args=("warm-up",), daemon=True
+            )
+
+        if background:
+            self._warm_up_thread.start()
+        else:
+            self._warm_up_thread.run()
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings, model_name, cache=embedding_cache):
+        """
+        Constructor for CachedEmbeddings class
+
+        Embeddings wrapper that looks up the vector of each text in the
+        embedding cache and only embeds the texts that are not cached.
+
+        :param embeddings: Embeddings object computing the missing vectors
+        :param model_name: Model name the vectors are cached for
+        :param cache: EmbeddingCache storing the vectors
+        """
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        """
+        Method to embed a list of texts, reusing the cached vectors
+
+        :param texts: List of texts
+        :return: List of embedding vectors
+        """
+        keys = [self.cache.make_key(text) for text in texts]
+        vectors = self.cache.get(self.model_name, keys)
+
+        # Embed each missing text once, even if it occurs several times
+        missing = dict()
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+        if missing:
+            missing_vectors = self.embeddings.embed_documents(list(missing.values()))
+            self.cache.put(self.model_name, list(missing), missing_vectors)
+            embedded = dict(zip(missing, missing_vectors))
+            vectors = [
+                embedded[key] if vector is None else vector
+                for key, vector in zip(keys, vectors)
+            ]
+        return vectors
+
+    def embed_query(self, text):
+        """
+        Method to embed a query (not cached)
+
+        :param text: Query text
+        :return: Embedding vector
+        """
+        return self.embeddings.embed_query(text)
+
+
+# Shared embedding model of the processed documents
+hf_embedding_service = EmbeddingService()
+
+# Shared embedding model with the vectors cached by text
+cached_hf_embeddings = CachedEmbeddings(hf_embedding_service, EMBEDDING_MODEL)
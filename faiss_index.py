@@ -0,0 +1,210 @@
+import os
+import math
+import time
+import argparse
+
+import faiss
+import numpy as np
+
+from constants import FAISS_DB_DIR, FAISS_NPROBE, FAISS_EF_SEARCH
+
+# faiss.index_factory descriptions of the index variants.
+# {nlist} is the number of IVF lists and {m} the number of PQ sub-quantizers.
+INDEX_VARIANTS = {
+    "hnsw": "HNSW32",  # graph search, full precision vectors
+    "hnsw_sq8": "HNSW32,SQ8",  # graph search, int8 vectors
+    "ivf": "IVF{nlist},Flat",  # inverted lists, full precision vectors
+    "ivf_sq8": "IVF{nlist},SQ8",  # inverted lists, int8 vectors
+    "ivf_pq": "IVF{nlist},PQ{m}",  # inverted lists, product-quantized vectors
+    "sq8": "SQ8",  # exhaustive search, int8 vectors
+    "fp16": "SQfp16",  # exhaustive search, float16 vectors
+}
+
+
+def get_index_path(index_name, variant="flat", folder_path=FAISS_DB_DIR):
+    """
+    Get the path of an index variant
+
+    :param index_name: Name of the index saved by FAISS.save_local
+    :param variant: Index variant ("flat" is the index saved by FAISS.save_local)
+    :param folder_path: Folder of the index files
+    :return: Path of the .faiss file
+    """
+    suffix = "" if variant == "flat" else f"_{variant}"
+    return os.path.join(folder_path, f"{index_name}{suffix}.faiss")
+
+
+def default_pq_m(dim):
+    # About 16 dimensions per sub-quantizer, m must divide the dimension
+    for m in range(max(1, dim // 16), 0, -1):
+        if dim % m == 0:
+            return m
+
+
+def build_index_variant(
+    index_name, variant, folder_path=FAISS_DB_DIR, nlist=None, m=None
+):
+    """
+    Build an index variant from the vectors of the flat index
+
+    The vectors are added in the same order, so the docstore and the ID mapping
+    saved with the flat index (.pkl) are shared by all variants.
+
+    :param index_name: Name of the index saved by FAISS.save_local
+    :param variant: Index variant (key of INDEX_VARIANTS)
+    :param folder_path: Folder of the index files
+    :param nlist: Number of IVF lists (default: about 4 * sqrt(number of vectors))
+    :param m: Number of PQ sub-quantizers (default: about dimension / 16)
+    :return: Path of the built index
+    """
+    source = faiss.read_index(get_index_path(index_name, "flat", folder_path))
+    vectors = source.reconstruct_n(0, source.ntotal)
+    num_vectors, dim = vectors.shape
+
+    # k-means needs about 39 training vectors per centroid
+    nlist = nlist or max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+    m = m or default_pq_m(dim)
+    description = INDEX_VARIANTS[variant].format(nlist=nlist, m=m)
+    if "PQ" in description and num_vectors < 256:
+        raise ValueError(
+            f"{variant} needs at least 256 vectors to train, {index_name} has "
+            f"{num_vectors}"
+        )
+
+    index = faiss.index_factory(dim, description, source.metric_type)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+
+    output_path = get_index_path(index_name, variant, folder_path)
+    faiss.write_index(index, output_path)
+    print(f"{index_name}: {description} with {index.ntotal} vectors -> {output_path}")
+    return output_path
+
+
+def configure_search(index, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH):
+    """
+    Set the search parameters of an approximate index
+
+    :param index: FAISS index
+    :param nprobe: Number of IVF lists searched (IVF indexes)
+    :param ef_search: Search depth of the HNSW graph (HNSW indexes)
+    :return: The index
+    """
+    try:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    except RuntimeError:
+        # Not an IVF index
+        pass
+
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = ef_search
+    return index
+
+
+def resolve_index_path(index_name, variant="flat", folder_path=FAISS_DB_DIR):
+    """
+    Get the path of an index variant, or of the flat index if it was not built
+
+    :param index_name: Name of the index saved by FAISS.save_local
+    :param variant: Index variant ("flat" or a key of INDEX_VARIANTS)
+    :param folder_path: Folder of the index files
+    :return: Path of the .faiss file to read
+    """
+    index_path = get_index_path(index_name, variant, folder_path)
+    if not os.path.isfile(index_path):
+        index_path = get_index_path(index_name, "flat", folder_path)
+    return index_path
+
+
+def read_index(index_name, variant="flat", folder_path=FAISS_DB_DIR, mmap=False):
+    """
+    Read an index variant, falling back to the flat index if it was not built
+
+    With mmap, the index data is memory-mapped from the file when the index type
+    supports it, so the processes reading the same index share its pages.
+    Otherwise the index is read into memory.
+
+    :param index_name: Name of the index saved by FAISS.save_local
+    :param variant: Index variant ("flat" or a key of INDEX_VARIANTS)
+    :param folder_path: Folder of the index files
+    :param mmap: Memory-map the index file
+    :return: FAISS index with the configured search parameters
+    """
+    index_path = resolve_index_path(index_name, variant, folder_path)
+    if index_path != get_index_path(index_name, variant, folder_path):
+        print(f"Index variant {variant} of {index_name} not found, using flat")
+
+    if mmap:
+        # In-file codes of flat indexes (recent FAISS), then mmap of IVF lists
+        for io_flag in (
+            getattr(faiss, "IO_FLAG_MMAP_IFC", None),
+            faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY,
+        ):
+            if io_flag is None:
+                continue
+            try:
+                return configure_search(faiss.read_index(index_path, io_flag))
+            except RuntimeError as e:
+                # The index type does not support this flag
+                print(f"Cannot memory-map {index_path} with flags {io_flag}: {e}")
+    return configure_search(faiss.read_index(index_path))
+
+
+def evaluate_index(
+    index_name, variant, folder_path=FAISS_DB_DIR, k=10, num_queries=100
+):
+    """
+    Measure the recall and latency of an index variant against the flat index
+
+    Stored vectors are used as queries.
+
+    :param index_name: Name of the index saved by FAISS.save_local
+    :param variant: Index variant
+    :param folder_path: Folder of the index files
+    :param k: Number of results per query
+    :param num_queries: Number of queries
+    :return: Dictionary with the recall@k and the latency per query in ms
+    """
+    flat_index = faiss.read_index(get_index_path(index_name, "flat", folder_path))
+    rng = np.random.default_rng(0)
+    query_ids = rng.choice(
+        flat_index.ntotal, min(num_queries, flat_index.ntotal), replace=False
+    )
+    queries = np.vstack([flat_index.reconstruct(int(i)) for i in query_ids])
+    _, exact_ids = flat_index.search(queries, k)
+
+    index = read_index(index_name, variant, folder_path)
+    start_time = time.perf_counter()
+    _, approx_ids = index.search(queries, k)
+    latency = (time.perf_counter() - start_time) / len(queries)
+
+    recall = np.mean(
+        [
+            len(set(exact) & set(approx)) / len(exact)
+            for exact, approx in zip(exact_ids.tolist(), approx_ids.tolist())
+        ]
+    )
+    return {"recall": float(recall), "latency_ms": latency * 1000}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build quantized and approximate variants of saved FAISS indexes"
+    )
+    parser.add_argument("index_names", nargs="+", help="e.g. ESRS_index RBA_index")
+    parser.add_argument("--variant", choices=list(INDEX_VARIANTS), required=True)
+    parser.add_argument("--folder", default=FAISS_DB_DIR)
+    parser.add_argument("--nlist", type=int, help="number of IVF lists")
+    parser.add_argument("--m", type=int, help="number of PQ sub-quantizers")
+    parser.add_argument(
+        "--evaluate", action="store_true", help="report recall@10 and latency"
+    )
+    args = parser.parse_args()
+
+    for index_name in args.index_names:
+        build_index_variant(index_name, args.variant, args.folder, args.nlist, args.m)
+        if args.evaluate:
+            metrics = evaluate_index(index_name, args.variant, args.folder)
+            print(f"{index_name}: {metrics}")
@@ -0,0 +1,409 @@
+import os
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pymupdf
+from PIL import Image
+import PIL
+
+# The crop workers of layout_parser run this module in spawned processes, so it
+# only imports the imaging libraries (no constants, caches or LLM clients)
+
+# PIL format, file extension and MIME type of the crop formats
+CROP_FORMATS = {
+    "png": {"format": "PNG", "extension": "png", "mime_type": "image/png"},
+    "webp": {"format": "WEBP", "extension": "webp", "mime_type": "image/webp"},
+    "jpeg": {"format": "JPEG", "extension": "jpg", "mime_type": "image/jpeg"},
+}
+
+
+class ImageCropper:
+    @staticmethod
+    def load_image_without_rotation(file_path):
+        """
+        Method to load image and remove rotation
+
+        :param file_path: Path to the image file
+        :return: Image object with removed rotation
+        """
+        # Ignore EXIF tags
+        PIL.Image.LOAD_TRUNCATED_IMAGES = True
+
+        # Open image
+        img = Image.open(file_path)
+
+        # Get EXIF data
+        exif = img._getexif()
+
+        if exif:
+            # Find orientation information from EXIF
+            orientation_key = 274  # 'Orientation' tag key
+            if orientation_key in exif:
+                orientation = exif[orientation_key]
+
+                # Rotate image according to orientation
+                if orientation == 3:
+                    img = img.rotate(180, expand=True)
+                elif orientation == 6:
+                    img = img.rotate(270, expand=True)
+                elif orientation == 8:
+                    img = img.rotate(90, expand=True)
+
+        return img
+
+    @staticmethod
+    def pdf_to_image(pdf_file, page_num, dpi=300):
+        """
+        Method to convert a specific page of a PDF file to an image
+
+        :param page_num: Page number to convert (starts from 1)
+        :param dpi: Image resolution (default: 300)
+        :return: Converted image object
+        """
+        with pymupdf.open(pdf_file) as doc:
+            page = doc[page_num].get_pixmap(dpi=dpi)
+            target_page_size = [page.width, page.height]
+            page_img = Image.frombytes("RGB", target_page_size, page.samples)
+        return page_img
+
+    @staticmethod
+    def normalize_coordinates(coordinates):
+        """
+        Method to normalize coordinates
+
+        :param coordinates: Original coordinates list
+        :param output_page_size: Output page size [width, height]
+        :return: Normalized coordinates (x1, y1, x2, y2)
+        """
+        x_values = [coord["x"] for coord in coordinates]
+        y_values = [coord["y"] for coord in coordinates]
+        x1, y1, x2, y2 = min(x_values), min(y_values), max(x_values), max(y_values)
+
+        return (
+            x1,
+            y1,
+            x2,
+            y2,
+        )
+
+    @staticmethod
+    def render_pdf_region(page, coordinates, dpi=300):
+        """
+        Method to render only the given region of a PDF page
+
+        :param page: PyMuPDF page object
+        :param coordinates: Normalized coordinates (x1, y1, x2, y2)
+        :param dpi: Image resolution of the cropped region (default: 300)
+        :return: Rendered image object of the region
+        """
+        page_width, page_height = page.rect.width, page.rect.height
+        x1, y1, x2, y2 = coordinates
+        clip = pymupdf.Rect(
+            x1 * page_width, y1 * page_height, x2 * page_width, y2 * page_height
+        )
+        # The coordinates refer to the displayed (rotated) page,
+        # while the clip region is given in unrotated page coordinates
+        clip = clip * page.derotation_matrix
+        pixmap = page.get_pixmap(dpi=dpi, clip=clip)
+        return Image.frombytes("RGB", [pixmap.width, pixmap.height], pixmap.samples)
+
+    @staticmethod
+    def render_pdf_page(page, dpi=300):
+        """
+        Method to render a PDF page to an image
+
+        :param page: PyMuPDF page object
+        :param dpi: Image resolution (default: 300)
+        :return: Rendered image object
+        """
+        pixmap = page.get_pixmap(dpi=dpi)
+        return Image.frombytes("RGB", [pixmap.width, pixmap.height], pixmap.samples)
+
+    @staticmethod
+    def to_pixel_boxes(boxes, width, height):
+        """
+        Method to convert normalized boxes to pixel boxes
+
+        :param boxes: Normalized boxes array of shape (n, 4)
+        :param width: Image width in pixels
+        :param height: Image height in pixels
+        :return: Integer pixel boxes array of shape (n, 4), at least 1 pixel wide
+        """
+        size = np.array([width, height, width, height], dtype=np.float64)
+        pixel_boxes = np.floor(np.clip(boxes, 0.0, 1.0) * size).astype(np.int64)
+        pixel_boxes[:, 2:] = np.maximum(pixel_boxes[:, 2:], pixel_boxes[:, :2] + 1)
+        return pixel_boxes
+
+    @staticmethod
+    def merge_boxes(boxes, iou_threshold):
+        """
+        Method to merge duplicate and overlapping boxes
+
+        Boxes are grouped when their IoU is at least iou_threshold (transitively),
+        and each group is replaced by the box enclosing all of its members.
+
+        :param boxes: Normalized boxes array of shape (n, 4)
+        :param iou_threshold: Minimum IoU of two boxes to merge them
+        :return: (merged boxes array of shape (m, 4), group index of each box)
+        """
+        x1, y1, x2, y2 = boxes.T
+        areas = (x2 - x1) * (y2 - y1)
+
+        # Pairwise intersection over union
+        inter_w = np.minimum(x2[:, None], x2) - np.maximum(x1[:, None], x1)
+        inter_h = np.minimum(y2[:, None], y2) - np.maximum(y1[:, None], y1)
+        inter = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+        union = areas[:, None] + areas - inter
+        iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+        # Identical boxes are merged even if they have no area
+        overlaps = (iou >= iou_threshold) | np.all(boxes[:, None] == boxes, axis=2)
+
+        # Label the connected groups of overlapping boxes
+        groups = np.full(len(boxes), -1, dtype=np.int64)
+        num_groups = 0
+        for i in range(len(boxes)):
+            if groups[i] >= 0:
+                continue
+            groups[i] = num_groups
+            stack = [i]
+            while stack:
+                members = np.flatnonzero(overlaps[stack.pop()] & (groups < 0))
+                groups[members] = num_groups
+                stack.extend(members.tolist())
+            num_groups += 1
+
+        merged_boxes = np.empty((num_groups, 4), dtype=boxes.dtype)
+        for group in range(num_groups):
+            members = boxes[groups == group]
+            merged_boxes[group, :2] = members[:, :2].min(axis=0)
+            merged_boxes[group, 2:] = members[:, 2:].max(axis=0)
+        return merged_boxes, groups
+
+    @staticmethod
+    def crop_boxes(img, boxes):
+        """
+        Method to crop many regions of an image
+
+        :param img: Original image object
+        :param boxes: Normalized boxes array of shape (n, 4)
+        :return: List of cropped image objects
+        """
+        pixel_boxes = ImageCropper.to_pixel_boxes(boxes, *img.size)
+        return [img.crop(tuple(pixel_box)) for pixel_box in pixel_boxes.tolist()]
+
+    @staticmethod
+    def dhash(img, hash_size=8):
+        """
+        Method to compute the difference hash (dHash) of an image
+
+        Similar images (e.g. the same logo rendered at another size) have hashes
+        that differ in only a few bits.
+
+        :param img: Image object
+        :param hash_size: Number of rows and columns of compared pixels
+        :return: Hash as an integer of hash_size * hash_size bits
+        """
+        small = img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+        pixels = np.asarray(small, dtype=np.int16)
+        bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+        return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+    @staticmethod
+    def match_images(
+        content,
+        other_content,
+        max_aspect_difference,
+        max_pixel_difference,
+    ):
+        """
+        Method to check if two encoded images show the same picture
+
+        The images must have the same aspect ratio, and their grayscale pixels,
+        compared at the size of the smaller image, must differ by at most
+        max_pixel_difference on average.
+
+        :param content: Encoded bytes of the first image
+        :param other_content: Encoded bytes of the second image
+        :param max_aspect_difference: Maximum relative aspect ratio difference
+        :param max_pixel_difference: Maximum mean grayscale difference (0-255)
+        :return: True if the images match
+        """
+        img = Image.open(io.BytesIO(content))
+        other_img = Image.open(io.BytesIO(other_content))
+        (width, height), (other_width, other_height) = img.size, other_img.size
+        aspect, other_aspect = width / height, other_width / other_height
+        if abs(aspect - other_aspect) > max_aspect_difference * other_aspect:
+            return False
+
+        size = min(img.size, other_img.size, key=lambda size: size[0] * size[1])
+        pixels = np.asarray(img.convert("L").resize(size, Image.LANCZOS), np.int16)
+        other_pixels = np.asarray(
+            other_img.convert("L").resize(size, Image.LANCZOS), np.int16
+        )
+        return np.abs(pixels - other_pixels).mean() <= max_pixel_difference
+
+    @staticmethod
+    def encode_image(img, image_format="png", quality=85, max_dimension=None):
+        """
+        Method to encode an image in memory
+
+        :param img: Image object
+        :param image_format: Output format ("png", "webp" or "jpeg")
+        :param quality: Quality of the lossy formats (1-100)
+        :param max_dimension: Maximum width and height in pixels (optional)
+        :return: Encoded image bytes
+        """
+        if max_dimension and max(img.size) > max_dimension:
+            # Downscale in place, keeping the aspect ratio
+            img = img.copy()
+            img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        pil_format = CROP_FORMATS[image_format]["format"]
+        buffer = io.BytesIO()
+        if pil_format == "PNG":
+            img.save(buffer, pil_format)
+        else:
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            img.save(buffer, pil_format, quality=quality)
+        return buffer.getvalue()
+
+    @staticmethod
+    def crop_image(img, coordinates, output_file):
+        """
+        Method to crop image and save it according to given coordinates
+
+        :param img: Original image object
+        :param coordinates: Normalized coordinates (x1, y1, x2, y2)
+        :param output_file: Path to save the file
+        """
+        img_width, img_height = img.size
+        x1, y1, x2, y2 = [
+            int(coord * dim)
+            for coord, dim in zip(coordinates, [img_width, img_height] * 2)
+        ]
+        cropped_img = img.crop((x1, y1, x2, y2))
+        cropped_img.save(output_file)
+
+    # def crop_image(img, bounding_box, output_file):
+    #     """
+    #     Method to crop image and save it according to given bounding box
+
+    #     :param img: Original image object
+    #     :param bounding_box: Coordinates list of the area to crop [{"x": x, "y": y}, ...]
+    #     :param output_file: Path to save the file
+    #     """
+    #     x_values = [coord["x"] for coord in bounding_box]
+    #     y_values = [coord["y"] for coord in bounding_box]
+    #     x1, y1, x2, y2 = min(x_values), min(y_values), max(x_values), max(y_values)
+
+    #     cropped_img = img.crop((x1, y1, x2, y2))
+    #     cropped_img.save(output_file)
+
+
+def read_file_bytes(file_path):
+    with open(file_path, "rb") as f:
+        return f.read()
+
+
+def write_file_bytes(file_path, content):
+    with open(file_path, "wb") as f:
+        f.write(content)
+
+
+def crop_pages(files, file_type, page_jobs, output_folder, crop_dpi, crop_options):
+    """
+    Crop the elements of the given pages and encode them
+
+    This function runs in a worker process. The PDF is opened once per call.
+    The boxes of each page and category are merged when they are duplicates or
+    overlap, so that every distinct region is cropped only once. PDF pages with
+    many regions are rendered once per DPI and cropped in memory, other PDF pages
+    render only the region of each box. The encoded crops are written to disk by a
+    background thread while the next regions are cropped.
+
+    :param files: PDF file path, or list of image file paths
+    :param file_type: File type ("pdf" or "image")
+    :param page_jobs: List of (page number, element types, element IDs, categories,
+        normalized boxes array of shape (n, 4))
+    :param output_folder: Folder to save the cropped images
+    :param crop_dpi: Resolution of the cropped PDF regions per element category
+    :param crop_options: Dictionary with the "format", "quality" and "max_dimension"
+        of the encoded crops, the "merge_iou" of merged boxes and the
+        "page_render_min_elements" of a full page render
+    :return: List of (element type, element ID, output file path, encoded bytes,
+        difference hash)
+    """
+    cropped_files = []
+    extension = CROP_FORMATS[crop_options["format"]]["extension"]
+
+    # Open the PDF once, pages are rendered per cropped region
+    pdf_doc = pymupdf.open(files) if file_type == "pdf" else None
+
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        write_futures = []
+        for page_num, element_types, element_ids, categories, boxes in page_jobs:
+            if file_type == "pdf":
+                page = pdf_doc[page_num]
+                page_images = dict()  # full page renders by DPI
+            elif file_type == "image":
+                image_file = ImageCropper.load_image_without_rotation(files[page_num])
+
+            categories = np.asarray(categories)
+            for category in dict.fromkeys(categories.tolist()):
+                selected = np.flatnonzero(categories == category)
+                merged_boxes, groups = ImageCropper.merge_boxes(
+                    boxes[selected], crop_options["merge_iou"]
+                )
+
+                # Crop the regions of the page
+                dpi = crop_dpi[category]
+                if file_type == "image":
+                    images = ImageCropper.crop_boxes(image_file, merged_boxes)
+                elif (
+                    len(merged_boxes) >= crop_options["page_render_min_elements"]
+                    or dpi in page_images
+                ):
+                    # Render the page once per DPI for all its categories
+                    if dpi not in page_images:
+                        page_images[dpi] = ImageCropper.render_pdf_page(page, dpi=dpi)
+                    images = ImageCropper.crop_boxes(page_images[dpi], merged_boxes)
+                else:
+                    images = [
+                        ImageCropper.render_pdf_region(page, box, dpi=dpi)
+                        for box in merged_boxes.tolist()
+                    ]
+
+                # Each merged box is saved under the ID of its first element
+                crops = [None] * len(merged_boxes)
+                for index, group in zip(selected.tolist(), groups.tolist()):
+                    if crops[group] is None:
+                        output_file = os.path.join(
+                            output_folder, f"{element_ids[index]}.{extension}"
+                        )
+                        content = ImageCropper.encode_image(
+                            images[group],
+                            crop_options["format"],
+                            crop_options["quality"],
+                            crop_options["max_dimension"],
+                        )
+                        write_futures.append(
+                            writer.submit(write_file_bytes, output_file, content)
+                        )
+                        image_hash = ImageCropper.dhash(images[group])
+                        crops[group] = (output_file, content, image_hash)
+
+                    element_id = element_ids[index]
+                    cropped_files.append(
+                        (element_types[index], element_id, *crops[group])
+                    )
+                    print(f"page:{page_num}, id:{element_id}, path: {crops[group][0]}")
+
+        # Raise the errors of the background writes
+        for future in write_futures:
+            future.result()
+
+    if pdf_doc is not None:
+        pdf_doc.close()
+    return cropped_files
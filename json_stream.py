@@ -0,0 +1,130 @@
+import re
+import json
+import codecs
+
+
+class JsonArrayStreamParser:
+    # Structural characters outside of strings
+    _TOKEN = re.compile(r'["{}\[\]]')
+    # End of a string or start of an escape sequence
+    _STRING_TOKEN = re.compile(r'["\\]')
+
+    def __init__(self, key="elements"):
+        """
+        Constructor for JsonArrayStreamParser class
+
+        Incremental parser returning the items of an array of the top-level
+        JSON object (e.g. "elements" of a layout analysis result) as soon as each
+        item is complete. Other values are scanned without being decoded, so
+        large html/markdown/text payloads outside the array are never held in
+        memory.
+
+        :param key: Key of the array in the top-level object
+        """
+        self.key = key
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.in_array = False
+        self.last_string = None  # last string of the top-level object (keys)
+        self._string_pieces = None
+        self._item_pieces = None
+
+    def feed(self, text):
+        """
+        Method to parse the next part of the JSON text
+
+        :param text: Next part of the JSON text
+        :return: List of the array items completed in this part
+        """
+        items = []
+        pos = 0
+        # Start of the part of the current item contained in this text
+        item_start = 0 if self._item_pieces is not None else None
+
+        while pos < len(text):
+            if self.in_string:
+                if self.escape:
+                    # Skip the escaped character
+                    self.escape = False
+                    pos += 1
+                    continue
+                match = self._STRING_TOKEN.search(text, pos)
+                if match is None:
+                    if self._string_pieces is not None:
+                        self._string_pieces.append(text[pos:])
+                    break
+                if self._string_pieces is not None:
+                    self._string_pieces.append(text[pos : match.start()])
+                pos = match.end()
+                if match.group() == "\\":
+                    self.escape = True
+                    continue
+                # End of the string
+                self.in_string = False
+                if self._string_pieces is not None:
+                    self.last_string = "".join(self._string_pieces)
+                    self._string_pieces = None
+                continue
+
+            match = self._TOKEN.search(text, pos)
+            if match is None:
+                break
+            token = match.group()
+            pos = match.end()
+
+            if token == '"':
+                self.in_string = True
+                # Keep the strings of the top-level object to find the key
+                if self.depth == 1:
+                    self._string_pieces = []
+            elif token in "{[":
+                if self.depth == 1 and token == "[" and self.last_string == self.key:
+                    self.in_array = True
+                elif self.in_array and self.depth == 2 and token == "{":
+                    self._item_pieces = []
+                    item_start = match.start()
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.in_array and self.depth == 2 and token == "}":
+                    # End of an item
+                    self._item_pieces.append(text[item_start:pos])
+                    items.append(json.loads("".join(self._item_pieces)))
+                    self._item_pieces = None
+                    item_start = None
+                elif self.in_array and self.depth == 1:
+                    # End of the array
+                    self.in_array = False
+
+        if self._item_pieces is not None:
+            self._item_pieces.append(text[item_start:])
+        return items
+
+
+def iter_json_array(chunks, key="elements"):
+    """
+    Iterate over the items of a top-level JSON array from chunks of bytes
+
+    :param chunks: Iterable of bytes (e.g. a file or a streamed HTTP response)
+    :param key: Key of the array in the top-level object
+    :return: Iterator of the array items
+    """
+    parser = JsonArrayStreamParser(key)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        yield from parser.feed(decoder.decode(chunk))
+    yield from parser.feed(decoder.decode(b"", final=True))
+
+
+def iter_json_file_array(file_path, key="elements", chunk_size=1024 * 1024):
+    """
+    Iterate over the items of a top-level JSON array of a file
+
+    :param file_path: Path to the JSON file
+    :param key: Key of the array in the top-level object
+    :param chunk_size: Number of bytes read at once
+    :return: Iterator of the array items
+    """
+    with open(file_path, "rb") as f:
+        yield from iter_json_array(iter(lambda: f.read(chunk_size), b""), key)
@@ -1,13 +1,26 @@
 from dotenv import load_dotenv
 from langchain_teddynote import logging
-from typing import TypedDict
+from typing import Iterator, TypedDict
 import os
+import pickle
+import shutil
+import html
+import io
+import base64
+import hashlib
+import itertools
+import functools
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
 import pymupdf
 import fitz
 import json
 import requests
 from PIL import Image
-import PIL
 from langgraph.graph import StateGraph, END, START
 import re
 from langchain_core.prompts import PromptTemplate
@@ -17,14 +30,53 @@ from langchain.chains.combine_documents import (
     create_stuff_documents_chain,
 )
 from langchain_core.documents import Document
+from langchain_core.messages import HumanMessage, SystemMessage
 
-from langchain_teddynote.models import MultiModal
 from langchain_core.runnables import chain
 from langchain_core.pydantic_v1 import BaseModel, Field
 from langchain_core.output_parsers import PydanticOutputParser
 
 import ollama
 
+from constants import (
+    LAYOUT_MAX_CONCURRENCY,
+    LAYOUT_STREAM_CHUNK_SIZE,
+    CROP_DPI,
+    CROP_MERGE_IOU,
+    CROP_PAGE_RENDER_MIN_ELEMENTS,
+    CROP_FORMAT,
+    CROP_QUALITY,
+    CROP_MAX_DIMENSION,
+    CROP_DHASH_MAX_DISTANCE,
+    CROP_MATCH_MAX_ASPECT_DIFFERENCE,
+    CROP_MATCH_MAX_PIXEL_DIFFERENCE,
+    IMAGE_PACKING_ENABLED,
+    IMAGE_PACK_MAX_IMAGES,
+    IMAGE_PACK_MAX_PIXELS,
+    INGEST_THREADS,
+    OPENAI_MODEL,
+    OLLAMA_MODEL,
+    FINGERPRINT_DPI,
+    REVISION_DIR,
+    REVISION_MAX_BYTES,
+    SPLIT_TARGET_BYTES,
+    SPLIT_MAX_IMAGES,
+    LOCAL_PARSE_ENABLED,
+    LOCAL_PARSE_MAX_DRAWINGS,
+    LOCAL_PARSE_MAX_DRAWING_AREA,
+    LOCAL_PARSE_HEADING_SCALE,
+)
+from cache_utils import layout_cache, llm_cache
+from element_store import ElementStore
+from json_stream import iter_json_array, iter_json_file_array
+from image_cropper import (
+    CROP_FORMATS,
+    ImageCropper,
+    crop_pages,
+    read_file_bytes,
+)
+from llm_scheduler import llm_scheduler, OllamaMetricsCallback
+
 
 # Class to store GraphState
 class GraphState(TypedDict):
@@ -34,14 +86,30 @@ class GraphState(TypedDict):
     translate_toggle: bool  # translate toggle
     page_numbers: list[int]  # page numbers
     batch_size: int  # batch size
+    crop_dpi: dict[str, int]  # crop resolution per element category
+    crop_format: str  # encoding of the cropped images (png, webp, jpeg)
+    crop_quality: int  # quality of the webp/jpeg crops
+    crop_max_dimension: int  # longest side of the cropped images in pixels
+    max_concurrency: int  # max concurrent layout analysis requests
+    crop_workers: int  # max crop tasks of a call in the shared process pool
     split_filepaths: list[str]  # split files
+    page_ranges: list[tuple[int, int]]  # (start page, end page) of each PDF chunk
+    split_target_bytes: int  # target upload size of each PDF chunk
+    chunk_stats: list[dict]  # pages, estimated bytes and images of each PDF chunk
+    local_parse: bool  # parse text-only PDF pages locally
+    local_pages: list[int]  # text-only PDF pages parsed without the API
     index_contents: list[str]  # index contents
     analyzed_files: list[str]  # analyzed files
-    page_elements: dict[int, dict[str, list[dict]]]  # page elements
+    element_ids: Iterator[int]  # element ID counter shared across chunks
+    page_offset: int  # page number of the first image in split_filepaths
+    page_elements: ElementStore  # page elements
     page_metadata: dict[int, dict]  # page metadata
     doc_metadata: dict
     page_summary: dict[int, str]  # page summary
     images: list[str]  # image paths
+    crop_payloads: dict[int, bytes]  # encoded crops by element ID
+    crop_aliases: dict[int, int]  # duplicate element ID -> element ID of its crop
+    pack_images: bool  # summarize the small figures of a page in one request
     images_summary: list[str]  # image summary
     tables: list[str]  # table
     tables_summary: dict[int, str]  # table summary
@@ -59,45 +127,118 @@ class ExtractMetadata(BaseModel):
     title: str = Field(description="title of the document")
 
 
+class ImageSummary(BaseModel):
+    image_number: int = Field(description="number of the image, starting from 1")
+    summary: str = Field(description="summary of the image in the output format")
+
+
+class ImageSummaries(BaseModel):
+    summaries: list[ImageSummary] = Field(description="one summary per image")
+
+
+@functools.lru_cache(maxsize=64)
+def _file_sha256(file_path, size, mtime_ns):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def file_sha256(file_path):
+    """
+    Get the SHA-256 digest of a file, computed once per file version
+
+    :param file_path: Path to the file
+    :return: Digest bytes
+    """
+    stat = os.stat(file_path)
+    return _file_sha256(os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+
+
 class DocumentParser:
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache=None):
         """
         Constructor for DocumentParser class
 
         :param api_key: API key for Upstage API authentication
+        :param cache: LayoutCache consulted before calling the API (optional)
         """
         self.api_key = api_key
+        self.cache = cache
 
-    def _upstage_document_parse(self, input_file):
+    @staticmethod
+    def _write_chunks(chunks, f):
+        # Write each chunk to the file before passing it on
+        for chunk in chunks:
+            f.write(chunk)
+            yield chunk
+
+    def _upstage_document_parse(
+        self, document, filename, output_file, on_element=None, cache_input=None
+    ):
         """
         Analyze document using Upstage API
 
-        :param input_file: Path to the document file to analyze
+        The response is streamed to output_file as it arrives instead of being
+        decoded and serialized again, so the html/markdown/text payload of a chunk
+        is never held in memory at once. With on_element, the elements are also
+        parsed from the stream and passed on as soon as each one is received.
+
+        :param document: Bytes of the document to analyze
+        :param filename: File name sent with the document
+        :param output_file: Path to write the analysis result to
+        :param on_element: Function called with each element of the result
+            (optional)
+        :param cache_input: Bytes identifying the document in the cache
+            (default: the document bytes)
         :return: Path to the analysis result
         """
         # Upstage API endpoint URL
         url = "https://api.upstage.ai/v1/document-ai/document-parse"
         # Set header
         headers = {"Authorization": f"Bearer {self.api_key}"}
-        # Create file object for file upload
-        files = {"document": open(input_file, "rb")}
-
         data = {"output_formats": "['html', 'markdown', 'text']"}
 
-        # Send API request
-        response = requests.post(url, headers=headers, files=files, data=data)
-
-        # If the request is successful, save the result to a file
-        if response.status_code == 200:
-            output_file = os.path.splitext(input_file)[0] + ".json"
-            # Save the result to a file
-            with open(output_file, "w") as f:
-                json.dump(response.json(), f, ensure_ascii=False)
+        # Reuse the cached response if the same document was analyzed before
+        if self.cache is not None:
+            cache_key = self.cache.make_key(
+                document if cache_input is None else cache_input,
+                data["output_formats"],
+            )
+            if self.cache.get(cache_key, output_file):
+                if on_element is not None:
+                    for element in iter_json_file_array(output_file, "elements"):
+                        on_element(element)
+                return output_file
 
-            return output_file
-        else:
+        # Send API request
+        files = {"document": (filename, document)}
+        with requests.post(
+            url, headers=headers, files=files, data=data, stream=True
+        ) as response:
             # If the request fails, return an error message
-            raise ValueError(f"API request failed: {response.status_code}")
+            if response.status_code != 200:
+                raise ValueError(f"API request failed: {response.status_code}")
+
+            # Write the response to a temporary file so that an interrupted
+            # download never leaves a truncated result behind
+            tmp_file = f"{output_file}.tmp"
+            with open(tmp_file, "wb") as f:
+                chunks = self._write_chunks(
+                    response.iter_content(LAYOUT_STREAM_CHUNK_SIZE), f
+                )
+                if on_element is None:
+                    for _ in chunks:
+                        pass
+                else:
+                    for element in iter_json_array(chunks, "elements"):
+                        on_element(element)
+            os.replace(tmp_file, output_file)
+
+        if self.cache is not None:
+            self.cache.put(cache_key, output_file)
+        return output_file
 
     def execute(self, input_file):
         """
@@ -106,109 +247,211 @@ class DocumentParser:
         :param input_file: Path to the document file to analyze
         :return: Path to the analysis result
         """
-        return self._upstage_document_parse(input_file)
-
+        with open(input_file, "rb") as f:
+            document = f.read()
 
-class ImageCropper:
-    @staticmethod
-    def load_image_without_rotation(file_path):
-        """
-        Method to load image and remove rotation
+        # Save the result to a file
+        output_file = os.path.splitext(input_file)[0] + ".json"
+        return self._upstage_document_parse(
+            document, os.path.basename(input_file), output_file
+        )
 
-        :param file_path: Path to the image file
-        :return: Image object with removed rotation
+    def execute_pages(self, pdf_file, start_page, end_page, local_pages=()):
         """
-        # Ignore EXIF tags
-        PIL.Image.LOAD_TRUNCATED_IMAGES = True
+        Execute document analysis for a range of pages of a PDF file
 
-        # Open image
-        img = Image.open(file_path)
+        The pages are copied into an in-memory PDF and uploaded without writing
+        a split PDF file to disk. Pages listed in local_pages are not uploaded:
+        their elements are built from the PDF text layer instead.
 
-        # Get EXIF data
-        exif = img._getexif()
+        :param pdf_file: Path to the PDF file
+        :param start_page: First page to analyze (starts from 0)
+        :param end_page: Last page to analyze (inclusive)
+        :param local_pages: Text-only pages parsed locally
+        :return: Path to the analysis result
+        """
+        input_file_basename = os.path.splitext(pdf_file)[0]
+        chunk_name = f"{input_file_basename}_{start_page:04d}_{end_page:04d}"
+        output_file = f"{chunk_name}.json"
+        pages = range(start_page, end_page + 1)
+        api_pages = [page_num for page_num in pages if page_num not in local_pages]
+
+        local_elements = dict()
+        with pymupdf.open(pdf_file) as input_pdf:
+            # Build the elements of the text-only pages locally.
+            # Element pages are 1-based within the chunk, like in the API result.
+            for page_num in pages:
+                if page_num in local_pages:
+                    local_elements[page_num - start_page + 1] = (
+                        LocalLayoutParser.extract_elements(
+                            input_pdf[page_num], page_num - start_page + 1
+                        )
+                    )
 
-        if exif:
-            # Find orientation information from EXIF
-            orientation_key = 274  # 'Orientation' tag key
-            if orientation_key in exif:
-                orientation = exif[orientation_key]
+            if api_pages:
+                with pymupdf.open() as output_pdf:
+                    output_pdf.insert_pdf(
+                        input_pdf, from_page=start_page, to_page=end_page
+                    )
+                    if len(api_pages) < len(pages):
+                        # Keep only the pages sent to the API
+                        output_pdf.select(
+                            [page_num - start_page for page_num in api_pages]
+                        )
+                        document = output_pdf.tobytes(garbage=1)
+                    else:
+                        document = output_pdf.tobytes()
+
+        api_filename = f"{os.path.basename(chunk_name)}.pdf"
+        # The uploaded bytes differ on every build (PyMuPDF writes a new /ID),
+        # so the cache is keyed on the source file and the uploaded pages
+        cache_input = file_sha256(pdf_file) + json.dumps(api_pages).encode("utf-8")
+        if not local_elements:
+            # Save the API result as is if no page was parsed locally
+            return self._upstage_document_parse(
+                document, api_filename, output_file, cache_input=cache_input
+            )
 
-                # Rotate image according to orientation
-                if orientation == 3:
-                    img = img.rotate(180, expand=True)
-                elif orientation == 6:
-                    img = img.rotate(270, expand=True)
-                elif orientation == 8:
-                    img = img.rotate(90, expand=True)
+        # Merge the API elements and the local elements in page order.
+        # The API elements are written one by one as they arrive in the response.
+        local_page_nums = sorted(local_elements)
+        tmp_file = f"{output_file}.tmp"
+        with open(tmp_file, "w") as f:
+            f.write('{"elements": [')
+            separator = ""
+
+            def write_element(element):
+                nonlocal separator
+                f.write(separator + json.dumps(element, ensure_ascii=False))
+                separator = ", "
+
+            def write_local_pages(before_page):
+                while local_page_nums and local_page_nums[0] < before_page:
+                    for element in local_elements[local_page_nums.pop(0)]:
+                        write_element(element)
+
+            def write_api_element(element):
+                # Map the pages of the uploaded document back to the pages of the chunk
+                page_num = api_pages[int(element["page"]) - 1]
+                element["page"] = page_num - start_page + 1
+                write_local_pages(element["page"])
+                write_element(element)
+
+            if api_pages:
+                api_file = f"{chunk_name}.api.json"
+                self._upstage_document_parse(
+                    document,
+                    api_filename,
+                    api_file,
+                    on_element=write_api_element,
+                    cache_input=cache_input,
+                )
+                os.remove(api_file)
+            write_local_pages(float("inf"))
+            f.write("]}")
+        os.replace(tmp_file, output_file)
+        return output_file
 
-        return img
 
+class LocalLayoutParser:
     @staticmethod
-    def pdf_to_image(pdf_file, page_num, dpi=300):
+    def is_text_only_page(page):
         """
-        Method to convert a specific page of a PDF file to an image
+        Method to check if a page can be parsed from its text layer
 
-        :param page_num: Page number to convert (starts from 1)
-        :param dpi: Image resolution (default: 300)
-        :return: Converted image object
-        """
-        with pymupdf.open(pdf_file) as doc:
-            page = doc[page_num].get_pixmap(dpi=dpi)
-            target_page_size = [page.width, page.height]
-            page_img = Image.frombytes("RGB", target_page_size, page.samples)
-        return page_img
+        Pages with images, many or large vector drawings (charts, diagrams,
+        shaded cells), tables, rotation or without a text layer (scans) are sent
+        to the layout analysis API. Rules and underlines have almost no area and
+        do not count as large drawings.
 
-    @staticmethod
-    def normalize_coordinates(coordinates):
+        :param page: PyMuPDF page object
+        :return: True if the page only contains text
         """
-        Method to normalize coordinates
+        if page.rotation != 0 or page.get_images():
+            return False
+        if not page.get_text().strip():
+            return False
 
-        :param coordinates: Original coordinates list
-        :param output_page_size: Output page size [width, height]
-        :return: Normalized coordinates (x1, y1, x2, y2)
-        """
-        x_values = [coord["x"] for coord in coordinates]
-        y_values = [coord["y"] for coord in coordinates]
-        x1, y1, x2, y2 = min(x_values), min(y_values), max(x_values), max(y_values)
-
-        return (
-            x1,
-            y1,
-            x2,
-            y2,
-        )
+        drawings = page.get_drawings()
+        if len(drawings) > LOCAL_PARSE_MAX_DRAWINGS:
+            return False
+        max_area = abs(page.rect) * LOCAL_PARSE_MAX_DRAWING_AREA
+        if any(abs(drawing["rect"]) > max_area for drawing in drawings):
+            return False
+
+        # Table detection is the slowest check, run it last
+        return not page.find_tables().tables
 
     @staticmethod
-    def crop_image(img, coordinates, output_file):
+    def extract_elements(page, page_number):
         """
-        Method to crop image and save it according to given coordinates
+        Method to build layout elements from the text blocks of a page
+
+        The elements use the same schema as the Upstage API result.
 
-        :param img: Original image object
-        :param coordinates: Normalized coordinates (x1, y1, x2, y2)
-        :param output_file: Path to save the file
+        :param page: PyMuPDF page object
+        :param page_number: Page number stored in the elements
+        :return: List of elements
         """
-        img_width, img_height = img.size
-        x1, y1, x2, y2 = [
-            int(coord * dim)
-            for coord, dim in zip(coordinates, [img_width, img_height] * 2)
+        page_width, page_height = page.rect.width, page.rect.height
+        blocks = [
+            block for block in page.get_text("dict")["blocks"] if block["type"] == 0
         ]
-        cropped_img = img.crop((x1, y1, x2, y2))
-        cropped_img.save(output_file)
 
-    # def crop_image(img, bounding_box, output_file):
-    #     """
-    #     Method to crop image and save it according to given bounding box
-
-    #     :param img: Original image object
-    #     :param bounding_box: Coordinates list of the area to crop [{"x": x, "y": y}, ...]
-    #     :param output_file: Path to save the file
-    #     """
-    #     x_values = [coord["x"] for coord in bounding_box]
-    #     y_values = [coord["y"] for coord in bounding_box]
-    #     x1, y1, x2, y2 = min(x_values), min(y_values), max(x_values), max(y_values)
+        # The most common font size is considered the body text size
+        font_sizes = [
+            round(span["size"])
+            for block in blocks
+            for line in block["lines"]
+            for span in line["spans"]
+            if span["text"].strip()
+        ]
+        body_size = max(set(font_sizes), key=font_sizes.count) if font_sizes else 0
+
+        elements = []
+        for block in blocks:
+            lines = [
+                "".join(span["text"] for span in line["spans"]).strip()
+                for line in block["lines"]
+            ]
+            text = "\n".join(line for line in lines if line)
+            if not text:
+                continue
+
+            block_size = max(
+                span["size"] for line in block["lines"] for span in line["spans"]
+            )
+            x1, y1, x2, y2 = block["bbox"]
+            coordinates = [
+                {"x": x1 / page_width, "y": y1 / page_height},
+                {"x": x2 / page_width, "y": y1 / page_height},
+                {"x": x2 / page_width, "y": y2 / page_height},
+                {"x": x1 / page_width, "y": y2 / page_height},
+            ]
+
+            html_text = html.escape(text).replace("\n", "<br>")
+            if block_size >= body_size * LOCAL_PARSE_HEADING_SCALE and len(lines) <= 2:
+                category = "heading1"
+                content_html = f"<h1>{html_text}</h1>"
+                content_markdown = f"# {text}\n\n"
+            else:
+                category = "paragraph"
+                content_html = f"<p>{html_text}</p>"
+                content_markdown = f"{text}\n\n"
 
-    #     cropped_img = img.crop((x1, y1, x2, y2))
-    #     cropped_img.save(output_file)
+            elements.append(
+                {
+                    "category": category,
+                    "content": {
+                        "html": content_html,
+                        "markdown": content_markdown,
+                        "text": text,
+                    },
+                    "coordinates": coordinates,
+                    "page": page_number,
+                }
+            )
+        return elements
 
 
 def extract_start_end_page(filename):
@@ -252,7 +495,7 @@ FORMAT:
 
     prompt = prompt.partial(format=output_parser.get_format_instructions())
     llm = ChatOpenAI(
-        model_name="gpt-4o-mini",
+        model_name=OPENAI_MODEL,
         temperature=0,
     )
     metadata_extract_chain = prompt | llm | output_parser
@@ -260,9 +503,8 @@ FORMAT:
     return metadata_extract_chain
 
 
-def create_text_summary_chain():
-    prompt = PromptTemplate.from_template(
-        """Please summarize the sentence according to the following REQUEST.
+# Prompt of the text summary chain
+TEXT_SUMMARY_PROMPT = """Please summarize the sentence according to the following REQUEST.
     
         REQUEST:
         1. Summarize the main points in bullet points.
@@ -276,9 +518,22 @@ def create_text_summary_chain():
 
         SUMMARY:"
         """
-    )
 
-    llm = ChatOllama(model="gemma2-27B:latest", temperature=0)
+# Prompt of the text translation chain
+TEXT_TRANSLATE_PROMPT = """You are a translator with vast knowledge of human languages. Please translate the following context to {output_language}.
+        if the context language is same as {output_language}, just return the context as is.
+
+        CONTEXT:
+        {context}
+
+        TRANSLATED_TEXT:"
+        """
+
+
+def create_text_summary_chain():
+    prompt = PromptTemplate.from_template(TEXT_SUMMARY_PROMPT)
+
+    llm = ChatOllama(model=OLLAMA_MODEL, temperature=0)
 
     # Create a chain for document summarization
     # This chain takes multiple documents as input and combines them into one summarized text
@@ -288,18 +543,9 @@ def create_text_summary_chain():
 
 
 def create_text_translate_chain():
-    prompt = PromptTemplate.from_template(
-        """You are a translator with vast knowledge of human languages. Please translate the following context to {output_language}.
-        if the context language is same as {output_language}, just return the context as is.
-
-        CONTEXT:
-        {context}
-
-        TRANSLATED_TEXT:"
-        """
-    )
+    prompt = PromptTemplate.from_template(TEXT_TRANSLATE_PROMPT)
 
-    llm = ChatOllama(model="gemma2-27B:latest", temperature=0)
+    llm = ChatOllama(model=OLLAMA_MODEL, temperature=0)
 
     # Create a chain for document translation
     text_tranlate_chain = create_stuff_documents_chain(llm, prompt)
@@ -307,19 +553,111 @@ def create_text_translate_chain():
     return text_tranlate_chain
 
 
+# System prompt of the image summary requests
+IMAGE_SUMMARY_SYSTEM_PROMPT = """You are an expert in extracting useful information from IMAGE.
+    With a given image, your task is to extract key entities, summarize them, and write useful information.
+    Please write the summary in {language}."""
+
+# System prompt of the table summary requests
+TABLE_SUMMARY_SYSTEM_PROMPT = """You are an expert in extracting useful information from TABLE. With a given image, your task is to extract key entities, summarize them, and write useful information.
+    Please write the summary in {language}."""
+
+
+def cached_llm_map(model, prompt, language, func, inputs, cache_inputs):
+    """
+    Run an LLM call for each input, reusing the cached outputs of previous runs
+
+    :param model: Model name
+    :param prompt: Prompt template of the call
+    :param language: Output language
+    :param func: Function that performs the LLM call for one input
+    :param inputs: List of inputs passed to func
+    :param cache_inputs: List of tuples of texts or bytes identifying each input
+    :return: List of outputs in the same order as inputs
+    """
+    keys = [
+        llm_cache.make_key(model, prompt, language, *cache_input)
+        for cache_input in cache_inputs
+    ]
+    outputs = [llm_cache.get(key) for key in keys]
+
+    def call_and_cache(i):
+        # Cache each output as soon as its call finishes, so that the finished
+        # calls are kept when another call of the map fails
+        result = func(inputs[i])
+        llm_cache.put(keys[i], result)
+        return result
+
+    # Call the LLM only for the inputs that are not cached
+    missing = [i for i, output in enumerate(outputs) if output is None]
+    results = llm_scheduler.map(model, call_and_cache, missing)
+    for i, result in zip(missing, results):
+        outputs[i] = result
+
+    print(f"LLM cache: {llm_cache.stats()}")
+    return outputs
+
+
+def load_crop(file_path, content=None):
+    """
+    Get the encoded bytes and MIME type of a cropped image
+
+    :param file_path: Path to the cropped image
+    :param content: Encoded bytes kept in memory by the crop step (optional)
+    :return: (encoded bytes, MIME type)
+    """
+    if content is None:
+        content = read_file_bytes(file_path)
+    extension = os.path.splitext(file_path)[1].lstrip(".").lower()
+    mime_types = {
+        crop_format["extension"]: crop_format["mime_type"]
+        for crop_format in CROP_FORMATS.values()
+    }
+    return content, mime_types.get(extension, "image/png")
+
+
+def create_image_messages(image, system_prompt, user_prompt):
+    """
+    Create the messages of a multimodal request with an inline image
+
+    :param image: (encoded bytes, MIME type) of the image
+    :param system_prompt: System prompt
+    :param user_prompt: User prompt
+    :return: List of messages
+    """
+    return create_images_messages([image], system_prompt, user_prompt)
+
+
+def create_images_messages(images, system_prompt, user_prompt):
+    """
+    Create the messages of a multimodal request with inline images
+
+    :param images: List of (encoded bytes, MIME type) of the images
+    :param system_prompt: System prompt
+    :param user_prompt: User prompt
+    :return: List of messages
+    """
+    content = [{"type": "text", "text": user_prompt}]
+    for image_bytes, mime_type in images:
+        image_url = f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode()}"
+        content.append({"type": "image_url", "image_url": {"url": image_url}})
+    return [SystemMessage(content=system_prompt), HumanMessage(content=content)]
+
+
 @chain
 def extract_image_summary(data_batches):
+    if not data_batches:
+        return []
+
     # 객체 생성
     llm = ChatOpenAI(
         temperature=0,
-        model_name="gpt-4o-mini",
+        model_name=OPENAI_MODEL,
     )
 
-    system_prompt = """You are an expert in extracting useful information from IMAGE.
-    With a given image, your task is to extract key entities, summarize them, and write useful information.
-    Please write the summary in {language}."""
+    system_prompt = IMAGE_SUMMARY_SYSTEM_PROMPT
 
-    image_paths = []
+    images = []
     system_prompts = []
     user_prompts = []
 
@@ -339,32 +677,150 @@ SUMMARY:
 ENTITIES:
 DATA_INSIGHTS:
 """
-        image_paths.append(image_path)
+        images.append(load_crop(image_path, data_batch.get("image_bytes")))
         system_prompts.append(system_prompt)
         user_prompts.append(user_prompt_template)
 
-    # Create a multimodal object
-    multimodal_llm = MultiModal(llm)
-
-    # Query from image file
-    answer = multimodal_llm.batch(
-        image_paths, system_prompts, user_prompts, display_image=False
+    # Query with the encoded crops through the shared scheduler, skipping cached images
+    answer = cached_llm_map(
+        OPENAI_MODEL,
+        IMAGE_SUMMARY_SYSTEM_PROMPT,
+        language,
+        lambda prompts: llm.invoke(create_image_messages(*prompts)).content,
+        list(zip(images, system_prompts, user_prompts)),
+        [
+            (user_prompt, image_bytes)
+            for (image_bytes, _), user_prompt in zip(images, user_prompts)
+        ],
     )
     return answer
 
 
+# User prompt of the packed image summary requests
+PACKED_IMAGE_SUMMARY_PROMPT = """Here is the context related to the images: {context}
+
+LANGUAGE: {language}
+###
+
+There are {num_images} images, numbered from 1 in the order they are given.
+Write one summary per image with the following output format:
+
+TITLE:
+SUMMARY:
+ENTITIES:
+DATA_INSIGHTS:
+
+{format_instructions}
+"""
+
+
+def pack_image_batches(
+    data_batches, max_images=IMAGE_PACK_MAX_IMAGES, max_pixels=IMAGE_PACK_MAX_PIXELS
+):
+    """
+    Group the small figures of each page into packs summarized in one request
+
+    :param data_batches: List of image summary data batches
+    :param max_images: Maximum number of figures per pack
+    :param max_pixels: Maximum pixel area of a packed figure
+    :return: List of packs, each a list of indices into data_batches
+    """
+    small_figures = dict()  # page number -> indices of the small figures
+    for i, data_batch in enumerate(data_batches):
+        image_bytes, _ = load_crop(data_batch["image"], data_batch.get("image_bytes"))
+        # Only the image header is read to get the size
+        width, height = Image.open(io.BytesIO(image_bytes)).size
+        if width * height <= max_pixels:
+            small_figures.setdefault(data_batch["page"], []).append(i)
+
+    packs = []
+    for indices in small_figures.values():
+        for start in range(0, len(indices), max_images):
+            pack = indices[start : start + max_images]
+            # A single figure is sent with the regular request
+            if len(pack) > 1:
+                packs.append(pack)
+    return packs
+
+
+@chain
+def extract_packed_image_summary(packs):
+    """
+    Summarize packs of figures, one multimodal request per pack
+
+    :param packs: List of packs, each a list of image summary data batches of a page
+    :return: List of summaries per pack in the order of the figures, or None for
+        a pack whose response could not be parsed
+    """
+    if not packs:
+        return []
+
+    llm = ChatOpenAI(
+        temperature=0,
+        model_name=OPENAI_MODEL,
+    )
+    output_parser = PydanticOutputParser(pydantic_object=ImageSummaries)
+
+    pack_inputs = []
+    cache_inputs = []
+    for pack in packs:
+        language = pack[0]["lang"]
+        user_prompt = PACKED_IMAGE_SUMMARY_PROMPT.format(
+            context=pack[0]["text"],
+            language=language,
+            num_images=len(pack),
+            format_instructions=output_parser.get_format_instructions(),
+        )
+        images = [
+            load_crop(data_batch["image"], data_batch.get("image_bytes"))
+            for data_batch in pack
+        ]
+        pack_inputs.append((images, IMAGE_SUMMARY_SYSTEM_PROMPT, user_prompt))
+        cache_inputs.append((user_prompt, *[image_bytes for image_bytes, _ in images]))
+
+    # Query the packs through the shared scheduler, skipping cached packs
+    answers = cached_llm_map(
+        OPENAI_MODEL,
+        IMAGE_SUMMARY_SYSTEM_PROMPT,
+        language,
+        lambda prompts: llm.invoke(create_images_messages(*prompts)).content,
+        pack_inputs,
+        cache_inputs,
+    )
+
+    pack_summaries = []
+    for pack, answer in zip(packs, answers):
+        try:
+            summaries = {
+                image_summary.image_number: image_summary.summary
+                for image_summary in output_parser.parse(answer).summaries
+            }
+        except Exception as e:
+            print(f"Packed image summary could not be parsed: {e}")
+            summaries = dict()
+
+        # Fall back to single requests unless every figure has its summary
+        if set(summaries) == set(range(1, len(pack) + 1)):
+            pack_summaries.append([summaries[i + 1] for i in range(len(pack))])
+        else:
+            pack_summaries.append(None)
+    return pack_summaries
+
+
 @chain
 def extract_table_summary(data_batches):
+    if not data_batches:
+        return []
+
     # Create an object
     llm = ChatOpenAI(
         temperature=0,
-        model_name="gpt-4o-mini",
+        model_name=OPENAI_MODEL,
     )
 
-    system_prompt = """You are an expert in extracting useful information from TABLE. With a given image, your task is to extract key entities, summarize them, and write useful information.
-    Please write the summary in {language}."""
+    system_prompt = TABLE_SUMMARY_SYSTEM_PROMPT
 
-    image_paths = []
+    images = []
     system_prompts = []
     user_prompts = []
 
@@ -384,16 +840,21 @@ SUMMARY:
 ENTITIES:
 DATA_INSIGHTS:
 """
-        image_paths.append(image_path)
+        images.append(load_crop(image_path, data_batch.get("image_bytes")))
         system_prompts.append(system_prompt)
         user_prompts.append(user_prompt_template)
 
-    # Create a multimodal object
-    multimodal_llm = MultiModal(llm)
-
-    # Query from image file
-    answer = multimodal_llm.batch(
-        image_paths, system_prompts, user_prompts, display_image=False
+    # Query with the encoded crops through the shared scheduler, skipping cached tables
+    answer = cached_llm_map(
+        OPENAI_MODEL,
+        TABLE_SUMMARY_SYSTEM_PROMPT,
+        language,
+        lambda prompts: llm.invoke(create_image_messages(*prompts)).content,
+        list(zip(images, system_prompts, user_prompts)),
+        [
+            (user_prompt, image_bytes)
+            for (image_bytes, _), user_prompt in zip(images, user_prompts)
+        ],
     )
     return answer
 
@@ -406,16 +867,124 @@ def route_document(state: GraphState):
         return "merge_image"
 
 
+def estimate_xref_size(doc, xref):
+    """
+    Estimate the size of a PDF stream object without decoding it
+
+    :param doc: PyMuPDF document
+    :param xref: Cross reference number of the stream object
+    :return: Stream size in bytes
+    """
+    length_type, length = doc.xref_get_key(xref, "Length")
+    if length_type == "int":
+        return int(length)
+    # Indirect or missing length, read the raw stream
+    return len(doc.xref_stream_raw(xref) or b"")
+
+
+def group_pages(
+    doc, page_numbers, batch_size, target_bytes, max_images, local_pages=()
+):
+    """
+    Group pages into ranges of consecutive pages of similar upload size
+
+    Pages are added to a chunk until it would exceed the target size or the
+    maximum number of images, so chunks of scanned pages get fewer pages than
+    chunks of text pages. Images shared by several pages are counted once per chunk.
+
+    :param doc: PyMuPDF document
+    :param page_numbers: Sorted list of page numbers
+    :param batch_size: Maximum number of pages per chunk
+    :param target_bytes: Target upload size per chunk in bytes
+    :param max_images: Maximum number of images per chunk
+    :param local_pages: Text-only pages parsed locally, which are not uploaded
+    :return: List of (start page, end page) tuples and list of chunk statistics
+    """
+    page_ranges = []
+    chunk_stats = []
+    for page_num in page_numbers:
+        page = doc[page_num]
+        if page_num in local_pages:
+            content_size, image_sizes = 0, dict()
+        else:
+            content_size = sum(
+                estimate_xref_size(doc, xref) for xref in page.get_contents()
+            )
+            image_sizes = {
+                image[0]: estimate_xref_size(doc, image[0])
+                for image in page.get_images(full=True)
+            }
+
+        if page_ranges:
+            start_page, end_page = page_ranges[-1]
+            stats = chunk_stats[-1]
+            new_images = {
+                xref: size
+                for xref, size in image_sizes.items()
+                if xref not in stats["image_xrefs"]
+            }
+            page_size = content_size + sum(new_images.values())
+            if (
+                end_page == page_num - 1
+                and page_num - start_page < batch_size
+                and stats["estimated_bytes"] + page_size <= target_bytes
+                and len(stats["image_xrefs"]) + len(new_images) <= max_images
+            ):
+                # Add the page to the current chunk
+                page_ranges[-1] = (start_page, page_num)
+                stats["end_page"] = page_num
+                stats["pages"] += 1
+                stats["estimated_bytes"] += page_size
+                stats["image_xrefs"].update(new_images)
+                continue
+
+        # Start a new chunk
+        page_ranges.append((page_num, page_num))
+        chunk_stats.append(
+            {
+                "start_page": page_num,
+                "end_page": page_num,
+                "pages": 1,
+                "estimated_bytes": content_size + sum(image_sizes.values()),
+                "image_xrefs": set(image_sizes),
+            }
+        )
+
+    for stats in chunk_stats:
+        stats["images"] = len(stats.pop("image_xrefs"))
+    return page_ranges, chunk_stats
+
+
+def find_local_pages(doc, page_numbers):
+    """
+    Find the text-only pages that are parsed locally instead of by the API
+
+    :param doc: PyMuPDF document
+    :param page_numbers: Page numbers to classify
+    :return: List of text-only page numbers
+    """
+    return [
+        page_num
+        for page_num in page_numbers
+        if LocalLayoutParser.is_text_only_page(doc[page_num])
+    ]
+
+
 def split_pdf(state: GraphState):
     """
-    Split the input PDF into multiple smaller PDF files.
+    Split the input PDF into page ranges sized by their estimated upload size.
+
+    Each range has at most batch_size pages and is kept near split_target_bytes.
+    No split PDF files are written: the pages of each range are copied into an
+    in-memory PDF when they are sent to the layout analysis API.
 
     :param state: GraphState object, containing the PDF file path and batch size information
-    :return: GraphState object containing the list of split PDF file paths
+    :return: GraphState object containing the list of page ranges and page metadata
     """
     # Extract the PDF file path and batch size
     filepath = state["filepath"]
     batch_size = state["batch_size"]
+    target_bytes = state.get("split_target_bytes") or SPLIT_TARGET_BYTES
 
     # Open the PDF file
     input_pdf = fitz.open(filepath)
@@ -433,28 +1002,35 @@ def split_pdf(state: GraphState):
         }
         page_metadata[page] = metadata
 
-    ret = []
-    # Start the PDF splitting process
-    for start_page in range(0, num_pages, batch_size):
-        # Calculate the last page of the batch (to avoid exceeding the total page count)
-        end_page = min(start_page + batch_size, num_pages) - 1
-
-        # Create the name of the split PDF file
-        input_file_basename = os.path.splitext(filepath)[0]
-        output_file = f"{input_file_basename}_{start_page:04d}_{end_page:04d}.pdf"
-        print(f"Split PDF created: {output_file}")
-
-        # Create a new PDF file and insert pages
-        with pymupdf.open() as output_pdf:
-            output_pdf.insert_pdf(input_pdf, from_page=start_page, to_page=end_page)
-            output_pdf.save(output_file)
-            ret.append(output_file)
+    # Find the text-only pages that do not need the layout analysis API
+    if state.get("local_parse", LOCAL_PARSE_ENABLED):
+        local_pages = find_local_pages(input_pdf, range(num_pages))
+    else:
+        local_pages = []
+    print(f"Text-only pages parsed locally: {len(local_pages)}")
+
+    # Group the pages into chunks of similar upload size
+    page_ranges, chunk_stats = group_pages(
+        input_pdf,
+        range(num_pages),
+        batch_size,
+        target_bytes,
+        SPLIT_MAX_IMAGES,
+        set(local_pages),
+    )
+    for stats in chunk_stats:
+        print(f"Split PDF pages: {stats}")
 
     # Close the original PDF file
     input_pdf.close()
 
-    # Return the GraphState object containing the list of split PDF file paths
-    return GraphState(split_filepaths=ret, page_metadata=page_metadata)
+    # Return the GraphState object containing the list of page ranges
+    return GraphState(
+        page_ranges=page_ranges,
+        chunk_stats=chunk_stats,
+        local_pages=local_pages,
+        page_metadata=page_metadata,
+    )
 
 
 def merge_image(state: GraphState):
@@ -477,19 +1053,33 @@ def merge_image(state: GraphState):
 
 
 def analyze_layout(state: GraphState):
-    # Get the list of split PDF file paths
-    split_files = state["split_filepaths"]
-
     # Create a DocumentParser object. The API key is retrieved from the environment variable.
-    analyzer = DocumentParser(os.environ.get("UPSTAGE_API_KEY"))
+    # Responses are looked up in the shared layout cache before calling the API.
+    analyzer = DocumentParser(os.environ.get("UPSTAGE_API_KEY"), cache=layout_cache)
+
+    # PDF page ranges are uploaded from memory, images are uploaded as files
+    if state["filetype"] == "pdf":
+        chunks = state["page_ranges"]
+
+        local_pages = set(state.get("local_pages", []))
+
+        def execute(page_range):
+            return analyzer.execute_pages(state["filepath"], *page_range, local_pages)
 
-    # Initialize a list to store the paths of analyzed files
-    analyzed_files = []
+    else:
+        chunks = state["split_filepaths"]
+        execute = analyzer.execute
+
+    # Number of chunks sent to the API at the same time
+    max_concurrency = state.get("max_concurrency") or LAYOUT_MAX_CONCURRENCY
+    max_workers = max(1, min(max_concurrency, len(chunks)))
+
+    # Analyze the layout of the chunks concurrently.
+    # executor.map keeps the results in the same order as the chunks.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        analyzed_files = list(executor.map(execute, chunks))
 
-    # Analyze the layout of each split PDF file
-    for file in split_files:
-        # Execute the layout analysis and add the result file path to the list
-        analyzed_files.append(analyzer.execute(file))
+    print(f"Layout cache: {layout_cache.stats()}")
 
     # Sort the analyzed file paths and create a new GraphState object to return them
     # Sorting is performed to maintain the order of the files
@@ -497,13 +1087,16 @@ def analyze_layout(state: GraphState):
 
 
 def add_analyzed_layout(state: GraphState):
-    split_files = state["split_filepaths"]
-
-    analyzed_files = []
-
-    for file in split_files:
-        output_file = os.path.splitext(file)[0] + ".json"
-        analyzed_files.append(output_file)
+    if state["filetype"] == "pdf":
+        input_file_basename = os.path.splitext(state["filepath"])[0]
+        analyzed_files = [
+            f"{input_file_basename}_{start_page:04d}_{end_page:04d}.json"
+            for start_page, end_page in state["page_ranges"]
+        ]
+    else:
+        analyzed_files = [
+            os.path.splitext(file)[0] + ".json" for file in state["split_filepaths"]
+        ]
 
     return GraphState(analyzed_files=sorted(analyzed_files))
 
@@ -512,109 +1105,122 @@ def extract_page_elements(state: GraphState):
     # Get the list of analyzed JSON file paths
     json_files = state["analyzed_files"]
     file_type = state["filetype"]
-    # Initialize a dictionary to store page-wise elements
-    page_elements = dict()
+    # Initialize a compact store for page-wise elements
+    page_elements = ElementStore()
 
-    # Initialize a counter to assign unique element IDs
-    element_id = 0
+    # Initialize a counter to assign unique element IDs.
+    # The streaming pipeline shares one counter between all chunks.
+    element_ids = state.get("element_ids") or itertools.count()
+    page_offset = state.get("page_offset", 0)
+    # Page ranges are in the same order as the sorted analysis files
+    page_ranges = state.get("page_ranges")
 
     # Iterate through each JSON file
     for i, json_file in enumerate(json_files):
         if file_type == "image":
             pass
+        elif page_ranges:
+            start_page, _ = page_ranges[i]
         else:
             # Extract the start page number from the file name
             start_page, _ = extract_start_end_page(json_file)
 
-        # Load the JSON file
-        with open(json_file, "r") as f:
-            data = json.load(f)
-
-        # JSON 데이터의 각 요소를 처리합니다.
-        for element in data["elements"]:
+        # Read the elements of the JSON file incrementally.
+        # The document-level html/markdown/text of the result is never loaded.
+        for element in iter_json_file_array(
+            json_file, "elements", LAYOUT_STREAM_CHUNK_SIZE
+        ):
             # Convert the original page number to an integer
             if file_type == "image":
-                relative_page = i
+                relative_page = page_offset + i
             else:
                 original_page = int(element["page"])
                 # Calculate the relative page number based on the entire document
                 relative_page = start_page + original_page - 1
-            # If the list of elements for the page does not exist, create a new one
-            if relative_page not in page_elements:
-                page_elements[relative_page] = []
-
-            # Assign a unique ID to the element
-            element["id"] = element_id
-            element_id += 1
-
-            # Update the element's page number to the relative page number
-            element["page"] = relative_page
-            # Add the element to the list of elements for the page
-            page_elements[relative_page].append(element)
+            # Add the element with a unique ID and the relative page number.
+            # Only the category, bounding box and contents are kept.
+            page_elements.append_raw(next(element_ids), relative_page, element)
 
     # Create a new GraphState object with the extracted page-wise element information
     return GraphState(page_elements=page_elements)
 
 
 def extract_tag_elements_per_page(state: GraphState):
-    # Get the page-wise elements from the GraphState object
+    # The ElementStore groups the elements of each page by type on access:
+    # "image_elements", "table_elements", "text_elements", "chart_elements",
+    # "equation_elements", "index_elements" and all "elements" of the page.
+    # The elements are not copied into per-category lists.
     page_elements = state["page_elements"]
 
-    # Create a new dictionary to store the parsed page elements
-    parsed_page_elements = dict()
-
-    # Iterate through each page and its elements
-    for key, page_element in page_elements.items():
-        # Initialize lists to store image, table, text elements
-        image_elements = []
-        table_elements = []
-        text_elements = []
-        chart_elements = []
-        equation_elements = []
-        index_elements = []
-        # Iterate through each element in the page
-        for element in page_element:
-            if element["category"] == "figure":
-                # If the element is an image, add it to the image_elements list
-                image_elements.append(element)
-            elif element["category"] == "table":
-                # If the element is a table, add it to the table_elements list
-                table_elements.append(element)
-            elif element["category"] == "chart":
-                chart_elements.append(element)
-            elif element["category"] == "equation":
-                equation_elements.append(element)
-            elif element["category"] == "index":
-                index_elements.append(element)
-            else:
-                # If the element is not an image, table, chart, equation, or index, consider it a text element
-                text_elements.append(element)
-
-        # Store the categorized elements with the page key in a new dictionary
-        parsed_page_elements[key] = {
-            "image_elements": image_elements,
-            "table_elements": table_elements,
-            "text_elements": text_elements,
-            "chart_elements": chart_elements,
-            "equation_elements": equation_elements,
-            "index_elements": index_elements,
-            "elements": page_element,  # Store the original page elements as well
-        }
-
     # Return a new GraphState object containing the parsed page elements
-    return GraphState(page_elements=parsed_page_elements)
+    return GraphState(page_elements=page_elements)
 
 
 def extract_page_numbers(state: GraphState):
     return GraphState(page_numbers=list(state["page_elements"].keys()))
 
 
-def crop_image(state: GraphState):
+# Element lists cropped from the page images and the category of their elements
+CROP_ELEMENT_TYPES = {
+    "image_elements": "figure",
+    "table_elements": "table",
+}
+
+# Process pool shared by all crop_page_elements calls, created on first use
+_crop_executor = None
+_crop_executor_lock = threading.Lock()
+
+
+def get_crop_executor():
     """
-    Extract and crop images from a PDF file
+    Get the process pool of the crop workers
+
+    The pool is created once per process with the spawn start method: the calls
+    come from the worker threads of the chunks, and forking a process while other
+    threads hold locks (e.g. of the HTTP clients or the caches) can deadlock the
+    child.
+
+    :return: ProcessPoolExecutor with INGEST_THREADS workers
+    """
+    global _crop_executor
+    with _crop_executor_lock:
+        if _crop_executor is None:
+            _crop_executor = ProcessPoolExecutor(
+                max_workers=INGEST_THREADS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            atexit.register(_crop_executor.shutdown, cancel_futures=True)
+        return _crop_executor
+
+
+def reset_crop_executor(executor):
+    """
+    Drop a broken crop pool so that the next call creates a new one
+
+    :param executor: ProcessPoolExecutor returned by get_crop_executor
+    """
+    global _crop_executor
+    with _crop_executor_lock:
+        if _crop_executor is executor:
+            _crop_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def crop_page_elements(state: GraphState, element_types):
+    """
+    Crop the elements of the given types from each page
+
+    PDF pages are not rasterized in full: only the region of each element is
+    rendered at the DPI configured for its category. Image files are loaded once
+    per page. Pages without any element of the given types are skipped, and the
+    remaining pages are distributed over the shared pool of INGEST_THREADS
+    processes (see get_crop_executor).
 
     :param state: GraphState object
-    :return: GraphState object containing the cropped image information
+    :param element_types: Element list keys to crop (e.g. ["image_elements"])
+    :return: Dictionary of element list key to the cropped file paths by element ID,
+        dictionary of the encoded crops by element ID, and dictionary of duplicate
+        element ID to the element ID whose crop is kept
     """
     files = state["filepath"]  # File path
     file_type = state["filetype"]
@@ -625,30 +1231,193 @@ def crop_image(state: GraphState):
         output_folder = os.path.splitext(files)[0]  # Set the output folder path
     os.makedirs(output_folder, exist_ok=True)  # Create the output folder
 
-    cropped_images = dict()  # Dictionary to store the cropped image information
+    # Target resolution per element category
+    crop_dpi = {**CROP_DPI, **(state.get("crop_dpi") or {})}
+    # Encoding of the cropped images
+    crop_options = {
+        "format": state.get("crop_format") or CROP_FORMAT,
+        "quality": state.get("crop_quality") or CROP_QUALITY,
+        "max_dimension": state.get("crop_max_dimension", CROP_MAX_DIMENSION),
+        "merge_iou": CROP_MERGE_IOU,
+        "page_render_min_elements": CROP_PAGE_RENDER_MIN_ELEMENTS,
+    }
+
+    # Collect the elements to crop per page.
+    # The normalized boxes are taken from the bounding box column of the store.
+    page_elements = state["page_elements"]
+    page_jobs = []
     for page_num in page_numbers:
-        if file_type == "pdf":
-            image_file = ImageCropper.pdf_to_image(
-                files, page_num
-            )  # Convert the PDF page to an image
-        elif file_type == "image":
-            image_file = ImageCropper.load_image_without_rotation(files[page_num])
-
-        for element in state["page_elements"][page_num]["image_elements"]:
-            if element["category"] == "figure":
-                # Normalize the coordinates of the image element
-                normalized_coordinates = ImageCropper.normalize_coordinates(
-                    element["coordinates"]
+        page_element = page_elements[page_num]
+        elements = [
+            (element_type, element)
+            for element_type in element_types
+            for element in page_element[element_type]
+            if element.category == CROP_ELEMENT_TYPES[element_type]
+        ]
+        # Skip pages without any element to crop
+        if elements:
+            page_jobs.append(
+                (
+                    page_num,
+                    [element_type for element_type, _ in elements],
+                    [element.id for _, element in elements],
+                    [element.category for _, element in elements],
+                    page_elements.bbox_array([element for _, element in elements]),
                 )
+            )
+
+    # Distribute the pages over the worker processes
+    # Chunks processed concurrently share the pool, each with its own share of it
+    crop_workers = state.get("crop_workers") or INGEST_THREADS
+    num_workers = max(1, min(crop_workers, INGEST_THREADS, len(page_jobs)))
+    if num_workers == 1:
+        results = [
+            crop_pages(
+                files, file_type, page_jobs, output_folder, crop_dpi, crop_options
+            )
+        ]
+    else:
+        executor = get_crop_executor()
+        futures = [
+            executor.submit(
+                crop_pages,
+                files,
+                file_type,
+                page_jobs[i::num_workers],
+                output_folder,
+                crop_dpi,
+                crop_options,
+            )
+            for i in range(num_workers)
+        ]
+        try:
+            results = [future.result() for future in futures]
+        except BrokenProcessPool:
+            # A worker died, the pool cannot run other tasks
+            reset_crop_executor(executor)
+            raise
+
+    cropped_files = [cropped_file for result in results for cropped_file in result]
+    crop_aliases = deduplicate_crops(cropped_files)
+    output_files = {
+        element_id: (output_file, content)
+        for _, element_id, output_file, content, _ in cropped_files
+    }
+
+    # Dictionary to store the cropped file paths per element type.
+    # Identical duplicates point to the file of their canonical element, which is
+    # stored once. Perceptual duplicates keep their own file.
+    cropped_elements = {element_type: dict() for element_type in element_types}
+    crop_payloads = dict()
+    for element_type, element_id, output_file, content, _ in cropped_files:
+        if element_id in crop_aliases:
+            canonical_file, canonical_content = output_files[crop_aliases[element_id]]
+            if output_file != canonical_file and content == canonical_content:
+                if os.path.exists(output_file):
+                    os.remove(output_file)
+                output_file = canonical_file
+        else:
+            crop_payloads[element_id] = content
+        cropped_elements[element_type][element_id] = output_file
+    return cropped_elements, crop_payloads, crop_aliases
+
+
+def deduplicate_crops(cropped_files, max_distance=CROP_DHASH_MAX_DISTANCE):
+    """
+    Find the crops that repeat the crop of another element
+
+    Crops of the same element type are duplicates when they share a file (merged
+    boxes) or have the same bytes. With max_distance >= 0, figures are also
+    duplicates when their difference hashes are within max_distance bits and
+    ImageCropper.match_images confirms them pixel by pixel, which catches the
+    same logo or icon rendered at another size. The first element in ID order
+    is kept.
+
+    :param cropped_files: List of (element type, element ID, output file path,
+        encoded bytes, difference hash)
+    :param max_distance: Maximum Hamming distance of duplicate figures (-1 disables)
+    :return: Dictionary of duplicate element ID to the kept element ID
+    """
+    crop_aliases = dict()
+    canonical_files = dict()  # output file -> kept element ID
+    canonical_digests = dict()  # (element type, SHA-256) -> kept element ID
+    canonical_hashes = {"image_elements": ([], [])}  # element type -> (hashes, IDs)
+    contents = dict()  # kept element ID -> encoded bytes
+
+    for element_type, element_id, output_file, content, image_hash in sorted(
+        cropped_files, key=lambda cropped_file: cropped_file[1]
+    ):
+        canonical_id = canonical_files.get(output_file)
+        digest = (element_type, hashlib.sha256(content).digest())
+        if canonical_id is None:
+            canonical_id = canonical_digests.get(digest)
+
+        hashes, hash_ids = canonical_hashes.get(element_type, (None, None))
+        if canonical_id is None and hashes and max_distance >= 0:
+            # Hamming distance to all kept figures at once
+            differences = np.array(hashes, dtype=np.uint64) ^ np.uint64(image_hash)
+            distances = np.unpackbits(differences.view(np.uint8)).reshape(
+                len(hashes), -1
+            ).sum(axis=1)
+            # A hash match alone is not enough (e.g. blank regions and short
+            # callouts share a hash), confirm the closest figures pixel by pixel
+            for index in np.argsort(distances, kind="stable"):
+                if distances[index] > max_distance:
+                    break
+                if ImageCropper.match_images(
+                    content,
+                    contents[hash_ids[index]],
+                    CROP_MATCH_MAX_ASPECT_DIFFERENCE,
+                    CROP_MATCH_MAX_PIXEL_DIFFERENCE,
+                ):
+                    canonical_id = hash_ids[index]
+                    break
+
+        if canonical_id is None:
+            canonical_id = element_id
+            canonical_digests[digest] = element_id
+            if hashes is not None:
+                hashes.append(image_hash)
+                hash_ids.append(element_id)
+                contents[element_id] = content
+        else:
+            crop_aliases[element_id] = canonical_id
+        canonical_files.setdefault(output_file, canonical_id)
+    return crop_aliases
+
+
+def crop_elements(state: GraphState):
+    """
+    Extract and crop images and tables from a PDF file in a single pass over the pages
+
+    :param state: GraphState object
+    :return: GraphState object containing the cropped image and table information
+    """
+    cropped_elements, crop_payloads, crop_aliases = crop_page_elements(
+        state, list(CROP_ELEMENT_TYPES)
+    )
+    return GraphState(
+        images=cropped_elements["image_elements"],
+        tables=cropped_elements["table_elements"],
+        crop_payloads=crop_payloads,
+        crop_aliases=crop_aliases,
+    )
+
+
+def crop_image(state: GraphState):
+    """
+    Extract and crop images from a PDF file
 
-                # Set the path to save the cropped image
-                output_file = os.path.join(output_folder, f"{element['id']}.png")
-                # Crop the image and save it
-                ImageCropper.crop_image(image_file, normalized_coordinates, output_file)
-                cropped_images[element["id"]] = output_file
-                print(f"page:{page_num}, id:{element['id']}, path: {output_file}")
+    :param state: GraphState object
+    :return: GraphState object containing the cropped image information
+    """
+    cropped_elements, crop_payloads, crop_aliases = crop_page_elements(
+        state, ["image_elements"]
+    )
     return GraphState(
-        images=cropped_images
+        images=cropped_elements["image_elements"],
+        crop_payloads=crop_payloads,
+        crop_aliases=crop_aliases,
     )  # Return a new GraphState object containing the cropped image information
 
 
@@ -659,38 +1428,13 @@ def crop_table(state: GraphState):
     :param state: GraphState object
     :return: GraphState object containing the cropped table image information
     """
-    files = state["filepath"]  # PDF file path
-    file_type = state["filetype"]
-    page_numbers = state["page_numbers"]  # List of page numbers to process
-    if file_type == "image":
-        output_folder = os.path.splitext(files[0])[0]  # Set the output folder path
-    else:
-        output_folder = os.path.splitext(files)[0]  # Set the output folder path
-    os.makedirs(output_folder, exist_ok=True)  # Create the output folder
-
-    cropped_images = dict()  # Dictionary to store the cropped table image information
-    for page_num in page_numbers:
-        if file_type == "pdf":
-            image_file = ImageCropper.pdf_to_image(
-                files, page_num
-            )  # Convert the PDF page to an image
-        elif file_type == "image":
-            image_file = ImageCropper.load_image_without_rotation(files[page_num])
-        for element in state["page_elements"][page_num]["table_elements"]:
-            if element["category"] == "table":
-                # Normalize the coordinates of the table element
-                normalized_coordinates = ImageCropper.normalize_coordinates(
-                    element["coordinates"],
-                )
-
-                # Set the path to save the cropped table image
-                output_file = os.path.join(output_folder, f"{element['id']}.png")
-                # Crop the table image and save it
-                ImageCropper.crop_image(image_file, normalized_coordinates, output_file)
-                cropped_images[element["id"]] = output_file
-                print(f"page:{page_num}, id:{element['id']}, path: {output_file}")
+    cropped_elements, crop_payloads, crop_aliases = crop_page_elements(
+        state, ["table_elements"]
+    )
     return GraphState(
-        tables=cropped_images
+        tables=cropped_elements["table_elements"],
+        crop_payloads=crop_payloads,
+        crop_aliases=crop_aliases,
     )  # Return a new GraphState object containing the cropped table image information
 
 
@@ -703,33 +1447,13 @@ def extract_page_text(state: GraphState):
         extracted_texts[page_num] = ""
         page_element = state["page_elements"][page_num]
 
-        print(f"Page {page_num} structure: {page_element.keys()}")
+        print(f"Page {page_num} structure: {list(page_element.keys())}")
 
-        if "text_elements" in page_element:
-            for text_element in page_element["text_elements"]:
-                if (
-                    isinstance(text_element, dict)
-                    and "content" in text_element
-                    and "markdown" in text_element["content"]
-                ):
-                    extracted_texts[page_num] += text_element["content"]["markdown"]
-                else:
-                    print(
-                        f"Unexpected text_element structure on page {page_num}: {text_element}"
-                    )
+        for text_element in page_element["text_elements"]:
+            extracted_texts[page_num] += text_element["content"]["markdown"]
 
-        if "table_elements" in page_element:
-            for table_element in page_element["table_elements"]:
-                if (
-                    isinstance(table_element, dict)
-                    and "content" in table_element
-                    and "markdown" in table_element["content"]
-                ):
-                    extracted_texts[page_num] += table_element["content"]["markdown"]
-                else:
-                    print(
-                        f"Unexpected table_element structure on page {page_num}: {table_element}"
-                    )
+        for table_element in page_element["table_elements"]:
+            extracted_texts[page_num] += table_element["content"]["markdown"]
 
         documents = []
         source = os.path.splitext(files)[0]
@@ -751,7 +1475,7 @@ def extract_doc_metadata(state: GraphState):
     inputs = [{"context": Document(page_content=sorted_texts[0][1])}]
 
     doc_metadata_chain = create_extract_metadata_chain()
-    metadata = doc_metadata_chain.invoke(inputs)
+    metadata = llm_scheduler.call(OPENAI_MODEL, doc_metadata_chain.invoke, inputs)
 
     return GraphState(doc_metadata=metadata)
 
@@ -774,9 +1498,20 @@ def translate_text(state: GraphState):
         for page_num, text in sorted_texts
     ]
 
-    # Use text_tranlate_chain to generate translations in batch mode
+    # Use text_tranlate_chain to generate translations in batch mode.
+    # The shared scheduler limits the calls to the parallel slots of the Ollama server.
     text_tranlate_chain = create_text_translate_chain()
-    translation_results = text_tranlate_chain.batch(inputs)
+    ollama_metrics = OllamaMetricsCallback(llm_scheduler, OLLAMA_MODEL)
+    translation_results = cached_llm_map(
+        OLLAMA_MODEL,
+        TEXT_TRANSLATE_PROMPT,
+        translate_lang,
+        lambda input: text_tranlate_chain.invoke(
+            input, config={"callbacks": [ollama_metrics]}
+        ),
+        inputs,
+        [(text,) for page_num, text in sorted_texts],
+    )
 
     # Map the translation results to the page numbers in order
     for page_num, translation in zip(page_numbers, translation_results):
@@ -808,14 +1543,27 @@ def create_text_summary(state: GraphState):
         for page_num, text in sorted_texts
     ]
 
-    # Use text_summary_chain to generate summaries in batch mode
+    # Use text_summary_chain to generate summaries in batch mode.
+    # The shared scheduler limits the calls to the parallel slots of the Ollama server.
     text_summary_chain = create_text_summary_chain()
-    summaries = text_summary_chain.batch(inputs)
+    ollama_metrics = OllamaMetricsCallback(llm_scheduler, OLLAMA_MODEL)
+    summaries = cached_llm_map(
+        OLLAMA_MODEL,
+        TEXT_SUMMARY_PROMPT,
+        translate_lang,
+        lambda input: text_summary_chain.invoke(
+            input, config={"callbacks": [ollama_metrics]}
+        ),
+        inputs,
+        [(text,) for page_num, text in sorted_texts],
+    )
 
     # Map the summaries to the page numbers in order
     for page_num, translation in zip(page_numbers, summaries):
         text_summary[page_num] = translation
 
+    print(f"LLM metrics: {llm_scheduler.metrics()}")
+
     # Return a new GraphState object containing the summarized text
     return GraphState(texts_summary=text_summary)
 
@@ -834,11 +1582,16 @@ def create_image_summary_data_batches(state: GraphState):
         for image_element in state["page_elements"][page_num]["image_elements"]:
             # Convert the image ID to an integer
             image_id = int(image_element["id"])
+            # Duplicates share the summary of the element whose crop is kept
+            if image_id in state.get("crop_aliases", {}):
+                continue
 
             # Add the image information, related text, page number, and ID to the data batch
             data_batches.append(
                 {
                     "image": state["images"][image_id],  # Image file path
+                    # Encoded image kept in memory by the crop step
+                    "image_bytes": state.get("crop_payloads", {}).get(image_id),
                     "text": text,  # Related text summary
                     "page": page_num,  # Page number
                     "id": image_id,  # Image ID
@@ -863,11 +1616,16 @@ def create_table_summary_data_batches(state: GraphState):
         for image_element in state["page_elements"][page_num]["table_elements"]:
             # Convert the table ID to an integer
             image_id = int(image_element["id"])
+            # Duplicates share the summary of the element whose crop is kept
+            if image_id in state.get("crop_aliases", {}):
+                continue
 
             # Add the table information, related text, page number, and ID to the data batch
             data_batches.append(
                 {
                     "table": state["tables"][image_id],  # Table data
+                    # Encoded table image kept in memory by the crop step
+                    "image_bytes": state.get("crop_payloads", {}).get(image_id),
                     "text": text,  # Related text summary
                     "page": page_num,  # Page number
                     "id": image_id,  # Table ID
@@ -878,10 +1636,47 @@ def create_table_summary_data_batches(state: GraphState):
     return GraphState(table_summary_data_batches=data_batches)
 
 
+def share_alias_summaries(cropped_files, summaries, crop_aliases):
+    """
+    Add the summaries of the duplicate crops, in element ID order
+
+    :param cropped_files: Dictionary of element ID to cropped file path
+    :param summaries: Dictionary of element ID to summary of the kept crops
+    :param crop_aliases: Dictionary of duplicate element ID to the kept element ID
+    :return: Dictionary of element ID to summary for every cropped element
+    """
+    shared_summaries = dict()
+    for element_id in sorted(cropped_files):
+        canonical_id = crop_aliases.get(element_id, element_id)
+        if canonical_id in summaries:
+            shared_summaries[element_id] = summaries[canonical_id]
+    return shared_summaries
+
+
 def create_image_summary(state: GraphState):
+    data_batches = state["image_summary_data_batches"]
+    image_summaries = [None] * len(data_batches)
+
+    # Summarize the small figures of each page together
+    if state.get("pack_images", IMAGE_PACKING_ENABLED):
+        packs = pack_image_batches(data_batches)
+        pack_summaries = extract_packed_image_summary.invoke(
+            [[data_batches[i] for i in pack] for pack in packs]
+        )
+        for pack, summaries in zip(packs, pack_summaries):
+            if summaries is not None:
+                for i, summary in zip(pack, summaries):
+                    image_summaries[i] = summary
+
     # Extract image summaries
     # Call the extract_image_summary function to generate image summaries
-    image_summaries = extract_image_summary.invoke(state["image_summary_data_batches"])
+    # for the figures that were not summarized in a pack
+    missing = [i for i, summary in enumerate(image_summaries) if summary is None]
+    single_summaries = extract_image_summary.invoke(
+        [data_batches[i] for i in missing]
+    )
+    for i, summary in zip(missing, single_summaries):
+        image_summaries[i] = summary
 
     # Initialize a dictionary to store the image summaries
     image_summary_output = dict()
@@ -893,6 +1688,13 @@ def create_image_summary(state: GraphState):
         # Use the ID of the data batch as the key to store the image summary
         image_summary_output[data_batch["id"]] = image_summary
 
+    # Map every duplicate figure to the summary of its kept crop
+    image_summary_output = share_alias_summaries(
+        state["images"], image_summary_output, state.get("crop_aliases", {})
+    )
+
+    print(f"LLM metrics: {llm_scheduler.metrics()}")
+
     # Return a new GraphState object containing the image summaries
     return GraphState(images_summary=image_summary_output)
 
@@ -911,15 +1713,444 @@ def create_table_summary(state: GraphState):
         # Use the ID of the data batch as the key to store the table summary
         table_summary_output[data_batch["id"]] = table_summary
 
+    # Map every duplicate table to the summary of its kept crop
+    table_summary_output = share_alias_summaries(
+        state["tables"], table_summary_output, state.get("crop_aliases", {})
+    )
+
+    print(f"LLM metrics: {llm_scheduler.metrics()}")
+
     # Return a new GraphState object containing the table summaries
     return GraphState(tables_summary=table_summary_output)
 
 
 def clean_up(state: GraphState):
-    for file in state["split_filepaths"] + state["analyzed_files"]:
+    for file in state.get("split_filepaths", []) + state["analyzed_files"]:
         os.remove(file)
 
 
+# Fields of the merged state that are kept sorted by page number or file name
+SORTED_STATE_LISTS = {
+    "page_numbers": None,
+    "split_filepaths": None,
+    "page_ranges": None,
+    "chunk_stats": lambda stats: stats["start_page"],
+    "local_pages": None,
+    "analyzed_files": None,
+    "documents": lambda document: document.metadata["page"],
+}
+
+
+def merge_graph_states(state: GraphState, update: GraphState):
+    """
+    Merge the output of a chunk pipeline into the document state
+
+    Element stores are copied into a store owned by the document state and
+    dictionaries are merged (dictionaries are kept sorted by key, page number or
+    element ID), lists are concatenated and other values are overwritten.
+
+    :param state: GraphState object of the whole document (updated in place)
+    :param update: GraphState object returned by a chunk pipeline
+    :return: The updated document state
+    """
+    for key, value in update.items():
+        current = state.get(key)
+        if isinstance(value, ElementStore):
+            # Copy into a store of the state, the chunk store may also be merged
+            # into other states (e.g. by the caller of incremental_document_ai)
+            if not isinstance(current, ElementStore):
+                current = state[key] = ElementStore()
+            current.update(value)
+        elif isinstance(value, dict) and isinstance(current, dict):
+            state[key] = dict(sorted({**current, **value}.items()))
+        elif isinstance(value, list) and isinstance(current, list):
+            state[key] = current + value
+            if key in SORTED_STATE_LISTS:
+                state[key].sort(key=SORTED_STATE_LISTS[key])
+        else:
+            state[key] = value
+    return state
+
+
+def process_chunk(state: GraphState, chunk, page_offset=0, crop_workers=None):
+    """
+    Run the whole Document AI pipeline for a single chunk
+
+    :param state: GraphState object with the document inputs
+    :param chunk: Page range of the PDF, or image file to process
+    :param page_offset: Page number of the image file (images only)
+    :param crop_workers: Max crop tasks of the chunk in the shared process pool
+    :return: GraphState object containing the results for the pages of the chunk
+    """
+    if state["filetype"] == "pdf":
+        chunk_input = {"page_ranges": [chunk]}
+    else:
+        chunk_input = {"split_filepaths": [chunk], "page_offset": page_offset}
+    chunk_state = GraphState(
+        {
+            **state,
+            **chunk_input,
+            "max_concurrency": 1,
+            "crop_workers": crop_workers or state.get("crop_workers"),
+        }
+    )
+
+    nodes = [
+        analyze_layout,
+        extract_page_elements,
+        extract_tag_elements_per_page,
+        extract_page_numbers,
+        crop_elements,
+        extract_page_text,
+    ]
+    if state["translate_toggle"]:
+        nodes.append(translate_text)
+    nodes += [
+        create_text_summary,
+        create_image_summary_data_batches,
+        create_table_summary_data_batches,
+        create_image_summary,
+        create_table_summary,
+    ]
+
+    for node in nodes:
+        chunk_state.update(node(chunk_state))
+
+    # Return only the results, without the inputs shared by all chunks
+    chunk_inputs = (
+        "page_ranges",
+        "split_filepaths",
+        "page_offset",
+        "max_concurrency",
+        "crop_workers",
+        "crop_payloads",  # already sent to the summaries, the crops are on disk
+    )
+    return GraphState(
+        {
+            key: value
+            for key, value in chunk_state.items()
+            if key not in state and key not in chunk_inputs
+        }
+    )
+
+
+def stream_document_ai(inputs: GraphState):
+    """
+    Process the document chunk by chunk instead of stage by stage
+
+    Each split file goes through layout analysis, element extraction, cropping,
+    text extraction and summarization on its own, so network waits of one chunk
+    overlap with the processing of the others. Up to max_concurrency chunks are
+    processed at the same time.
+
+    :param inputs: Graph inputs (same as graph_document_ai)
+    :return: Iterator of {node name: GraphState} updates, one "process_chunk"
+        update per chunk in order of completion
+    """
+    state = GraphState(**inputs)
+
+    # Split the document first, this step is fast and local
+    split_node = route_document(state)
+    split_output = split_pdf(state) if split_node == "split_pdf" else merge_image(state)
+    state.update(split_output)
+    yield {split_node: split_output}
+
+    if state["filetype"] == "pdf":
+        chunks = state.pop("page_ranges")
+    else:
+        chunks = state.pop("split_filepaths")
+    state["element_ids"] = itertools.count()
+    yield from process_chunks(state, chunks)
+
+
+def process_chunks(state: GraphState, chunks):
+    """
+    Process the chunks concurrently with process_chunk
+
+    The chunks crop their elements in the same process pool, and each chunk
+    splits its pages into at most INGEST_THREADS / (concurrent chunks) tasks,
+    so the number of crop processes stays bounded by INGEST_THREADS.
+
+    :param state: GraphState object with the document inputs and an element_ids counter
+    :param chunks: PDF page ranges or image files to process
+    :return: Iterator of {"process_chunk": GraphState} updates in order of completion
+    """
+    max_concurrency = state.get("max_concurrency") or LAYOUT_MAX_CONCURRENCY
+    max_workers = max(1, min(max_concurrency, len(chunks)))
+    crop_workers = max(1, INGEST_THREADS // max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(process_chunk, state, chunk, page_offset, crop_workers)
+            for page_offset, chunk in enumerate(chunks)
+        ]
+        for future in as_completed(futures):
+            yield {"process_chunk": future.result()}
+
+
+# Results of a revision that are reused for its unchanged pages
+REVISION_STATE_KEYS = [
+    "page_elements",
+    "texts",
+    "translated_texts",
+    "texts_summary",
+    "images",
+    "images_summary",
+    "tables",
+    "tables_summary",
+]
+
+
+def fingerprint_pages(filepath):
+    """
+    Compute a fingerprint of each page from its text layer and a low resolution render
+
+    :param filepath: PDF file path
+    :return: List of page fingerprints (hex digests) in page order
+    """
+    fingerprints = []
+    with pymupdf.open(filepath) as doc:
+        for page in doc:
+            digest = hashlib.sha256(page.get_text().encode("utf-8"))
+            digest.update(page.get_pixmap(dpi=FINGERPRINT_DPI).samples)
+            fingerprints.append(digest.hexdigest())
+    return fingerprints
+
+
+def get_revision_file(revision_key):
+    """
+    Get the file storing the revisions of a document
+
+    The key is hashed, so any text (e.g. typed by a user) maps to a file name
+    inside REVISION_DIR.
+
+    :param revision_key: Identifier shared by the revisions of a document
+    :return: Path of the revision file
+    """
+    digest = hashlib.sha256(revision_key.encode("utf-8")).hexdigest()
+    return os.path.join(REVISION_DIR, f"{digest}.pkl")
+
+
+def load_revision(revision_key):
+    """
+    Load the stored fingerprints and results of the previous revision of a document
+
+    :param revision_key: Identifier shared by the revisions of a document
+    :return: Stored revision dictionary, or None if the document was never processed
+    """
+    revision_file = get_revision_file(revision_key)
+    if not os.path.isfile(revision_file):
+        return None
+    with open(revision_file, "rb") as f:
+        revision = pickle.load(f)
+    # Touch the file so that it is the most recently used revision
+    os.utime(revision_file)
+
+    # Revisions stored before page elements were kept in an ElementStore
+    page_elements = revision["state"].get("page_elements")
+    if not isinstance(page_elements, ElementStore):
+        return None
+    # Revisions stored with the elements of each chunk merged twice
+    if len(set(page_elements.ids)) != len(page_elements.ids):
+        return None
+    return revision
+
+
+def save_revision(revision_key, fingerprints, state: GraphState):
+    """
+    Store the page fingerprints and results of a processed revision
+
+    :param revision_key: Identifier shared by the revisions of a document
+    :param fingerprints: Page fingerprints returned by fingerprint_pages
+    :param state: GraphState object of the processed document
+    """
+    os.makedirs(REVISION_DIR, exist_ok=True)
+    revision = {
+        "fingerprints": fingerprints,
+        "translate_lang": state["translate_lang"],
+        "translate_toggle": state["translate_toggle"],
+        "state": {key: state[key] for key in REVISION_STATE_KEYS if key in state},
+    }
+    revision_file = get_revision_file(revision_key)
+    tmp_file = f"{revision_file}.{threading.get_ident()}.tmp"
+    with open(tmp_file, "wb") as f:
+        pickle.dump(revision, f)
+    os.replace(tmp_file, revision_file)
+    prune_revisions()
+
+
+def prune_revisions(max_bytes=REVISION_MAX_BYTES):
+    """
+    Delete the least recently used revisions beyond a total size
+
+    :param max_bytes: Maximum total size of the stored revisions in bytes
+    """
+    entries = []
+    total_size = 0
+    for filename in os.listdir(REVISION_DIR):
+        if not filename.endswith(".pkl"):
+            continue
+        path = os.path.join(REVISION_DIR, filename)
+        stat = os.stat(path)
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total_size += stat.st_size
+
+    entries.sort()
+    for _, size, path in entries:
+        if total_size <= max_bytes:
+            break
+        os.remove(path)
+        total_size -= size
+
+
+def match_unchanged_pages(fingerprints, previous):
+    """
+    Match the pages of the new revision with identical pages of the previous one
+
+    :param fingerprints: Page fingerprints of the new revision
+    :param previous: Stored previous revision
+    :return: Dictionary of new page number to previous page number
+    """
+    previous_pages = dict()
+    for page_num, fingerprint in enumerate(previous["fingerprints"]):
+        previous_pages.setdefault(fingerprint, []).append(page_num)
+
+    page_map = dict()
+    for page_num, fingerprint in enumerate(fingerprints):
+        # Each previous page is reused at most once to keep element IDs unique
+        if previous_pages.get(fingerprint):
+            page_map[page_num] = previous_pages[fingerprint].pop(0)
+    return page_map
+
+
+def reuse_pages(state: GraphState, previous, page_map):
+    """
+    Copy the results of the unchanged pages from the previous revision
+
+    :param state: GraphState object with the document inputs
+    :param previous: Stored previous revision
+    :param page_map: Dictionary of new page number to previous page number
+    :return: GraphState object containing the results of the unchanged pages
+    """
+    previous_state = previous["state"]
+    output_folder = os.path.splitext(state["filepath"])[0]
+    os.makedirs(output_folder, exist_ok=True)
+
+    reused = GraphState(page_elements=ElementStore(), texts=dict(), documents=[])
+    for page_num, previous_page in page_map.items():
+        # Pages without elements (e.g. blank pages) only have their texts
+        if previous_page in previous_state["page_elements"]:
+            reused["page_elements"].copy_page(
+                previous_state["page_elements"], previous_page, page_num
+            )
+
+        for key in ("texts", "translated_texts", "texts_summary"):
+            if previous_page in previous_state.get(key, {}):
+                reused.setdefault(key, dict())[page_num] = previous_state[key][
+                    previous_page
+                ]
+
+        text = reused["texts"].get(page_num, "")
+        metadata = {"page": page_num, "source": output_folder}
+        reused["documents"].append(Document(page_content=text, metadata=metadata))
+
+    # Copy the crops of the reused elements into the output folder of this revision
+    reused_ids = set(reused["page_elements"].ids)
+    for key in ("images", "tables"):
+        reused[key] = dict()
+        for element_id, path in previous_state.get(key, {}).items():
+            if element_id not in reused_ids or not os.path.isfile(path):
+                continue
+            output_file = os.path.join(output_folder, os.path.basename(path))
+            if os.path.abspath(output_file) != os.path.abspath(path):
+                shutil.copyfile(path, output_file)
+            reused[key][element_id] = output_file
+
+    for key in ("images_summary", "tables_summary"):
+        reused[key] = {
+            element_id: summary
+            for element_id, summary in previous_state.get(key, {}).items()
+            if element_id in reused_ids
+        }
+
+    reused["page_numbers"] = sorted(page_map)
+    return reused
+
+
+def incremental_document_ai(inputs: GraphState, revision_key):
+    """
+    Process a new revision of a PDF, re-running the pipeline only for changed pages
+
+    Pages are matched with the previous revision by fingerprint. The results of
+    unchanged pages are reused and only the changed pages go through layout
+    analysis, cropping and summarization. The fingerprints and results of this
+    revision are stored for the next one.
+
+    :param inputs: Graph inputs (same as graph_document_ai, PDF only)
+    :param revision_key: Identifier shared by the revisions of a document
+    :return: Iterator of {node name: GraphState} updates like stream_document_ai
+    """
+    state = GraphState(**inputs)
+    fingerprints = fingerprint_pages(state["filepath"])
+    previous = load_revision(revision_key)
+
+    # Results in another language cannot be reused
+    if previous is not None and (
+        previous["translate_lang"] != state["translate_lang"]
+        or previous["translate_toggle"] != state["translate_toggle"]
+    ):
+        previous = None
+
+    page_map = match_unchanged_pages(fingerprints, previous) if previous else dict()
+    changed_pages = [
+        page_num for page_num in range(len(fingerprints)) if page_num not in page_map
+    ]
+    print(f"Unchanged pages: {len(page_map)}, changed pages: {len(changed_pages)}")
+
+    # Page metadata is cheap to compute for every page
+    target_bytes = state.get("split_target_bytes") or SPLIT_TARGET_BYTES
+    with pymupdf.open(state["filepath"]) as input_pdf:
+        page_metadata = {
+            page_num: {"size": [int(page.rect.width), int(page.rect.height)]}
+            for page_num, page in enumerate(input_pdf)
+        }
+        if state.get("local_parse", LOCAL_PARSE_ENABLED):
+            local_pages = find_local_pages(input_pdf, changed_pages)
+        else:
+            local_pages = []
+        page_ranges, chunk_stats = group_pages(
+            input_pdf,
+            changed_pages,
+            state["batch_size"],
+            target_bytes,
+            SPLIT_MAX_IMAGES,
+            set(local_pages),
+        )
+    split_output = GraphState(
+        page_ranges=page_ranges,
+        chunk_stats=chunk_stats,
+        local_pages=local_pages,
+        page_metadata=page_metadata,
+    )
+    state.update(page_metadata=page_metadata, local_pages=local_pages)
+    merged = GraphState(**inputs, **split_output)
+    yield {"split_pdf": split_output}
+
+    if page_map:
+        reused = reuse_pages(state, previous, page_map)
+        merge_graph_states(merged, reused)
+        yield {"reuse_pages": reused}
+
+    # New elements get IDs after the IDs of the previous revision
+    previous_ids = merged["page_elements"].ids if "page_elements" in merged else []
+    state["element_ids"] = itertools.count(max(previous_ids, default=-1) + 1)
+
+    for output in process_chunks(state, page_ranges):
+        merge_graph_states(merged, output["process_chunk"])
+        yield output
+
+    save_revision(revision_key, fingerprints, merged)
+
+
 def graph_document_ai(translate_toggle: bool):
     workflow = StateGraph(GraphState)
 
@@ -932,8 +2163,7 @@ def graph_document_ai(translate_toggle: bool):
     workflow.add_node("extract_tag_elements_per_page", extract_tag_elements_per_page)
     workflow.add_node("extract_page_numbers", extract_page_numbers)
 
-    workflow.add_node("crop_image", crop_image)
-    workflow.add_node("crop_table", crop_table)
+    workflow.add_node("crop_elements", crop_elements)
     workflow.add_node("extract_page_text", extract_page_text)
 
     if translate_toggle:
@@ -962,9 +2192,10 @@ def graph_document_ai(translate_toggle: bool):
     workflow.add_edge("analyze_layout", "extract_page_elements")
     workflow.add_edge("extract_page_elements", "extract_tag_elements_per_page")
     workflow.add_edge("extract_tag_elements_per_page", "extract_page_numbers")
-    workflow.add_edge("extract_page_numbers", "crop_image")
-    workflow.add_edge("crop_image", "crop_table")
-    workflow.add_edge("crop_table", "extract_page_text")
+
+    # Cropping and text extraction are independent and run in parallel
+    workflow.add_edge("extract_page_numbers", "crop_elements")
+    workflow.add_edge("extract_page_numbers", "extract_page_text")
 
     if translate_toggle:
         workflow.add_edge("extract_page_text", "translate_text")
@@ -972,12 +2203,19 @@ def graph_document_ai(translate_toggle: bool):
     else:
         workflow.add_edge("extract_page_text", "create_text_summary")
 
-    workflow.add_edge("create_text_summary", "create_image_summary_data_batches")
+    # The summary data batches need both the crops and the text summaries
     workflow.add_edge(
-        "create_image_summary_data_batches", "create_table_summary_data_batches"
+        ["crop_elements", "create_text_summary"], "create_image_summary_data_batches"
     )
-    workflow.add_edge("create_table_summary_data_batches", "create_image_summary")
-    workflow.add_edge("create_image_summary", "create_table_summary")
+    workflow.add_edge(
+        ["crop_elements", "create_text_summary"], "create_table_summary_data_batches"
+    )
+
+    # Image and table summaries are independent branches,
+    # the graph finishes once both of them reached END
+    workflow.add_edge("create_image_summary_data_batches", "create_image_summary")
+    workflow.add_edge("create_table_summary_data_batches", "create_table_summary")
+    workflow.add_edge("create_image_summary", END)
     workflow.add_edge("create_table_summary", END)
 
     graph = workflow.compile()
@@ -0,0 +1,275 @@
+import time
+import random
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from constants import (
+    LLM_MAX_IN_FLIGHT,
+    LLM_MODEL_MAX_IN_FLIGHT,
+    LLM_RATE_LIMITS,
+    LLM_MAX_RETRIES,
+    LLM_BACKOFF_SECONDS,
+)
+
+
+class TokenBucket:
+    def __init__(self, requests_per_minute, capacity=None):
+        """
+        Constructor for TokenBucket class
+
+        :param requests_per_minute: Number of requests allowed per minute
+        :param capacity: Maximum burst size (default: one second worth of requests, at least 1)
+        """
+        self.rate = requests_per_minute / 60
+        self.capacity = capacity or max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Method to wait until a request is allowed by the rate limit
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+def is_rate_limit_error(error):
+    """
+    Method to check if an exception was caused by a rate limit (HTTP 429)
+
+    :param error: Exception raised by the LLM call
+    :return: True if the request should be retried after a backoff
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    message = str(error).lower()
+    return status_code == 429 or "429" in message or "rate limit" in message
+
+
+class RequestScheduler:
+    def __init__(
+        self,
+        max_in_flight=LLM_MAX_IN_FLIGHT,
+        rate_limits=LLM_RATE_LIMITS,
+        max_retries=LLM_MAX_RETRIES,
+        backoff_seconds=LLM_BACKOFF_SECONDS,
+        model_max_in_flight=LLM_MODEL_MAX_IN_FLIGHT,
+    ):
+        """
+        Constructor for RequestScheduler class
+
+        All LLM calls share the max_in_flight limit. Models listed in rate_limits
+        are additionally throttled with a token bucket, and models listed in
+        model_max_in_flight have their own, lower concurrency limit (e.g. the
+        parallel slots of a local Ollama server).
+
+        :param max_in_flight: Maximum number of concurrent LLM calls
+        :param rate_limits: Requests per minute by model name
+        :param max_retries: Number of retries after a rate limit error
+        :param backoff_seconds: Initial backoff, doubled after every retry
+        :param model_max_in_flight: Maximum number of concurrent calls by model name
+        """
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.model_max_in_flight = model_max_in_flight
+        self._semaphore = threading.BoundedSemaphore(max_in_flight)
+        self._model_semaphores = {
+            model: threading.BoundedSemaphore(limit)
+            for model, limit in model_max_in_flight.items()
+        }
+        self._buckets = {
+            model: TokenBucket(requests_per_minute)
+            for model, requests_per_minute in rate_limits.items()
+        }
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(list)
+        self._retries = defaultdict(int)
+        self._queue_depth = defaultdict(int)
+        self._max_queue_depth = defaultdict(int)
+        self._in_flight = defaultdict(int)
+        self._eval_tokens = defaultdict(int)
+        self._eval_seconds = defaultdict(float)
+        self._busy_since = dict()  # model -> start of the current busy period
+        self._busy_seconds = defaultdict(float)
+
+    def _acquire(self, model):
+        # Count the callers waiting for an in-flight slot (queue depth gauge)
+        with self._lock:
+            self._queue_depth[model] += 1
+            self._max_queue_depth[model] = max(
+                self._max_queue_depth[model], self._queue_depth[model]
+            )
+
+        model_semaphore = self._model_semaphores.get(model)
+        if model_semaphore is not None:
+            model_semaphore.acquire()
+        self._semaphore.acquire()
+
+        with self._lock:
+            self._queue_depth[model] -= 1
+            if self._in_flight[model] == 0:
+                self._busy_since[model] = time.perf_counter()
+            self._in_flight[model] += 1
+
+    def _release(self, model):
+        with self._lock:
+            self._in_flight[model] -= 1
+            if self._in_flight[model] == 0:
+                self._busy_seconds[model] += (
+                    time.perf_counter() - self._busy_since.pop(model)
+                )
+
+        self._semaphore.release()
+        model_semaphore = self._model_semaphores.get(model)
+        if model_semaphore is not None:
+            model_semaphore.release()
+
+    def call(self, model, func, *args, **kwargs):
+        """
+        Method to run a single LLM call under the concurrency and rate limits
+
+        :param model: Model name used to select the rate limit
+        :param func: Function that performs the LLM call
+        :return: Result of func
+        """
+        bucket = self._buckets.get(model)
+        for attempt in range(self.max_retries + 1):
+            if bucket is not None:
+                bucket.acquire()
+
+            self._acquire(model)
+            start_time = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.max_retries or not is_rate_limit_error(e):
+                    raise
+            else:
+                with self._lock:
+                    self._latencies[model].append(time.perf_counter() - start_time)
+                return result
+            finally:
+                self._release(model)
+
+            # Exponential backoff with jitter, outside of the in-flight slot
+            with self._lock:
+                self._retries[model] += 1
+            time.sleep(self.backoff_seconds * 2**attempt * (1 + random.random()))
+
+    def record_tokens(self, model, tokens, seconds):
+        """
+        Method to record the generated tokens of an LLM call
+
+        :param model: Model name
+        :param tokens: Number of generated tokens
+        :param seconds: Generation time reported by the model server
+        """
+        with self._lock:
+            self._eval_tokens[model] += tokens
+            self._eval_seconds[model] += seconds
+
+    def map(self, model, func, inputs):
+        """
+        Method to run an LLM call for each input concurrently
+
+        :param model: Model name used to select the rate limit
+        :param func: Function that performs the LLM call for one input
+        :param inputs: List of inputs
+        :return: List of results in the same order as inputs
+        """
+        if not inputs:
+            return []
+        max_workers = min(
+            self.model_max_in_flight.get(model, self.max_in_flight),
+            self.max_in_flight,
+            len(inputs),
+        )
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(
+                executor.map(lambda input: self.call(model, func, input), inputs)
+            )
+
+    def metrics(self):
+        """
+        Method to get the call metrics per model
+
+        Token throughput is reported for models whose calls record their tokens:
+        tokens_per_second is the generation speed of a single request and
+        aggregate_tokens_per_second the throughput over the time the model had
+        at least one call in flight.
+
+        :return: Dictionary of model name to calls, retries, latency statistics,
+            queue depth and token throughput
+        """
+        metrics = dict()
+        with self._lock:
+            for model, latencies in self._latencies.items():
+                latencies = sorted(latencies)
+                metrics[model] = {
+                    "calls": len(latencies),
+                    "retries": self._retries[model],
+                    "mean_latency": sum(latencies) / len(latencies),
+                    "p50_latency": latencies[len(latencies) // 2],
+                    "p95_latency": latencies[int(len(latencies) * 0.95)],
+                    "in_flight": self._in_flight[model],
+                    "queue_depth": self._queue_depth[model],
+                    "max_queue_depth": self._max_queue_depth[model],
+                }
+
+                tokens = self._eval_tokens.get(model)
+                if tokens:
+                    busy_seconds = self._busy_seconds[model]
+                    if model in self._busy_since:
+                        busy_seconds += time.perf_counter() - self._busy_since[model]
+                    metrics[model].update(
+                        {
+                            "eval_tokens": tokens,
+                            "tokens_per_second": tokens / self._eval_seconds[model],
+                            "aggregate_tokens_per_second": tokens / busy_seconds,
+                        }
+                    )
+        return metrics
+
+
+class OllamaMetricsCallback(BaseCallbackHandler):
+    def __init__(self, scheduler, model):
+        """
+        Constructor for OllamaMetricsCallback class
+
+        Records the generated tokens of each Ollama call in the scheduler metrics,
+        from the eval_count and eval_duration (nanoseconds) of the response.
+
+        :param scheduler: RequestScheduler recording the tokens
+        :param model: Model name the tokens are recorded for
+        """
+        self.scheduler = scheduler
+        self.model = model
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                info = generation.generation_info or {}
+                if info.get("eval_count") and info.get("eval_duration"):
+                    self.scheduler.record_tokens(
+                        self.model, info["eval_count"], info["eval_duration"] / 1e9
+                    )
+
+
+# Shared scheduler used by every LLM call of the Document AI pipeline
+llm_scheduler = RequestScheduler()
@@ -1,5 +1,10 @@
 import streamlit as st
 
+from embedding_service import hf_embedding_service
+
+# Load the embedding model once at server start, in the background
+hf_embedding_service.warm_up()
+
 local_gpt = st.Page("01_local_GPT_agent.py", title="Local GPT", icon="💬")
 document_ai = st.Page("02_Document_AI.py", title="Document AI", icon="📄")
 esrs_ai = st.Page("03_ESRS_AI.py", title="ESRS AI", icon="🔍")
@@ -23,10 +23,14 @@ def add_page_numbers(content):
     return "\n".join(pages)
 
 
-def add_images(output_folder, content):
+def add_images(output_folder, content, image_paths=None):
     pages = []
     for image_num, page_content in content.items():
-        image_path = f"{image_num}.png"
+        # Duplicate elements share the crop saved under another element ID
+        if image_paths and image_num in image_paths:
+            image_path = os.path.basename(image_paths[image_num])
+        else:
+            image_path = f"{image_num}.png"
         if os.path.exists(os.path.join(output_folder, image_path)):
             pages_with_image = f"\n\n![{image_num}]({image_path})\n\n{page_content}"
         else:
@@ -72,9 +76,13 @@ def create_md(file_path, state: GraphState, type="translate"):
     elif type == "text_summary" and texts_summary is not None:
         conbined_texts = add_page_numbers(texts_summary)
     elif type == "image_summary" and images_summary is not None:
-        conbined_texts = add_images(output_folder, images_summary)
+        conbined_texts = add_images(
+            output_folder, images_summary, state.get("images")
+        )
     elif type == "table_summary" and tables_summary is not None:
-        conbined_texts = add_images(output_folder, tables_summary)
+        conbined_texts = add_images(
+            output_folder, tables_summary, state.get("tables")
+        )
     else:
         st.error(f"Invalid type or missing data for type: {type}")
         return
@@ -1,25 +1,128 @@
 import os
+import pickle
+import hashlib
+import threading
 
 from langchain.embeddings import OpenAIEmbeddings
 from langchain.vectorstores import FAISS
 from langchain.retrievers.ensemble import EnsembleRetriever
 from langchain_community.retrievers import BM25Retriever
 from langchain_community.document_loaders import PDFPlumberLoader
-from langchain_huggingface.embeddings import HuggingFaceEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-from constants import EMBEDDING_MODEL
+from constants import (
+    EMBEDDING_MODEL,
+    FAISS_DB_DIR,
+    DOCUMENT_INDEX_PREFIX,
+    DOCUMENT_INDEX_MAX_COUNT,
+    FAISS_INDEX_VARIANT,
+)
+from embedding_service import cached_hf_embeddings, CachedEmbeddings
+from faiss_index import get_index_path, resolve_index_path, read_index
 
 
 def get_hf_embeddings():
-    return HuggingFaceEmbeddings(
-        model_name=EMBEDDING_MODEL,
-        model_kwargs={"device": "cuda:1"},  # mps, cpu
-        encode_kwargs={"normalize_embeddings": True},
+    # The model is loaded once per process and shared by every retriever,
+    # and the vectors of texts embedded before are read from the cache
+    return cached_hf_embeddings
+
+
+def get_document_index_key(documents):
+    """
+    Create the key of the retriever index of a list of documents
+
+    :param documents: List of Document objects
+    :return: Hex digest of the embedding model and the document contents
+    """
+    digest = hashlib.sha256(EMBEDDING_MODEL.encode("utf-8"))
+    for document in documents:
+        for part in (document.page_content, repr(sorted(document.metadata.items()))):
+            part = part.encode("utf-8")
+            # Prefix every part with its length so that parts cannot run together
+            digest.update(len(part).to_bytes(8, "big"))
+            digest.update(part)
+    return digest.hexdigest()
+
+
+def get_file_index_key(file_paths):
+    """
+    Create the key of the retriever index of source files
+
+    The key only depends on the file contents, so the retriever of an uploaded
+    file can be looked up before the file is processed.
+
+    :param file_paths: Path of the PDF file, or list of paths of the image files
+    :return: Hex digest of the embedding model and the file contents
+    """
+    if isinstance(file_paths, str):
+        file_paths = [file_paths]
+    digest = hashlib.sha256(EMBEDDING_MODEL.encode("utf-8"))
+    for file_path in file_paths:
+        file_digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                file_digest.update(chunk)
+        digest.update(file_digest.digest())
+    return digest.hexdigest()
+
+
+def _document_index_paths(index_key):
+    index_name = f"{DOCUMENT_INDEX_PREFIX}{index_key}"
+    bm25_path = os.path.join(FAISS_DB_DIR, f"{index_name}_bm25.pkl")
+    return index_name, bm25_path
+
+
+def build_ensemble_retriever(faiss_retriever, bm25_retriever):
+    return EnsembleRetriever(
+        retrievers=[faiss_retriever, bm25_retriever],
+        weights=[0.5, 0.5],
+    )
+
+
+def load_ensemble_retriever(index_key):
+    """
+    Load a saved ensemble retriever of processed documents
+
+    :param index_key: Key returned by get_file_index_key or get_document_index_key
+    :return: EnsembleRetriever, or None if no retriever was saved for the key
+    """
+    index_name, bm25_path = _document_index_paths(index_key)
+    # The BM25 file is written last, so it marks a complete index
+    if not os.path.isfile(bm25_path):
+        return None
+    # Mark the index as recently used for prune_document_indexes
+    os.utime(bm25_path)
+
+    vectorstore = FAISS.load_local(
+        folder_path=FAISS_DB_DIR,
+        index_name=index_name,
+        embeddings=get_hf_embeddings(),
+        allow_dangerous_deserialization=True,
     )
+    faiss_retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+
+    with open(bm25_path, "rb") as f:
+        bm25_retriever = pickle.load(f)
+
+    return build_ensemble_retriever(faiss_retriever, bm25_retriever)
+
+
+def create_ensemble_retriever(documents, index_key=None):
+    """
+    Create an ensemble (FAISS + BM25) retriever of processed documents
 
+    The indexes are saved in FAISS_DB_DIR under the given key (e.g. the hash of
+    the source file) or the hash of the documents, so the same documents are
+    loaded instead of being embedded again.
 
-def create_ensemble_retriever(documents):
+    :param documents: List of Document objects
+    :param index_key: Key of the saved indexes (default: get_document_index_key)
+    :return: EnsembleRetriever
+    """
+    index_key = index_key or get_document_index_key(documents)
+    ensemble_retriever = load_ensemble_retriever(index_key)
+    if ensemble_retriever is not None:
+        return ensemble_retriever
 
     hf_embeddings = get_hf_embeddings()
 
@@ -33,12 +136,47 @@ def create_ensemble_retriever(documents):
     bm25_retriever = BM25Retriever.from_documents(documents)
     bm25_retriever.k = 3
 
-    ensemble_retriever = EnsembleRetriever(
-        retrievers=[faiss_retriever, bm25_retriever],
-        weights=[0.5, 0.5],
-    )
+    # Save the indexes
+    index_name, bm25_path = _document_index_paths(index_key)
+    vectorstore.save_local(folder_path=FAISS_DB_DIR, index_name=index_name)
+    tmp_path = f"{bm25_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(bm25_retriever, f)
+    os.replace(tmp_path, bm25_path)
+    prune_document_indexes()
+
+    return build_ensemble_retriever(faiss_retriever, bm25_retriever)
+
+
+def prune_document_indexes(max_count=DOCUMENT_INDEX_MAX_COUNT):
+    """
+    Delete the least recently used retriever indexes of processed documents
 
-    return ensemble_retriever
+    :param max_count: Number of document indexes to keep
+    :return: List of the deleted index names
+    """
+    if not os.path.isdir(FAISS_DB_DIR):
+        return []
+
+    # Files of each index: .faiss, .pkl, _bm25.pkl and the index variants
+    key_length = len(DOCUMENT_INDEX_PREFIX) + hashlib.sha256().digest_size * 2
+    index_files = dict()
+    for file_name in os.listdir(FAISS_DB_DIR):
+        if file_name.startswith(DOCUMENT_INDEX_PREFIX):
+            index_files.setdefault(file_name[:key_length], []).append(file_name)
+
+    def last_used(index_name):
+        # Last write, or last load (the BM25 file is touched when loaded)
+        return max(
+            os.path.getmtime(os.path.join(FAISS_DB_DIR, file_name))
+            for file_name in index_files[index_name]
+        )
+
+    index_names = sorted(index_files, key=last_used, reverse=True)
+    for index_name in index_names[max_count:]:
+        for file_name in index_files[index_name]:
+            os.remove(os.path.join(FAISS_DB_DIR, file_name))
+    return index_names[max_count:]
 
 
 def create_retriever_from_PDF(file):
@@ -57,7 +195,8 @@ def create_retriever_from_PDF(file):
     split_documents = text_splitter.split_documents(docs)
 
     # Step 3: Create Embeddings
-    embeddings = OpenAIEmbeddings()
+    openai_embeddings = OpenAIEmbeddings()
+    embeddings = CachedEmbeddings(openai_embeddings, openai_embeddings.model)
 
     # Step 4: Create DB and Save
     # Create a vector store.
@@ -69,17 +208,81 @@ def create_retriever_from_PDF(file):
     return retriever
 
 
-def load_existing_retriever(index_name):
-    faiss_path = os.path.join("faiss_db", f"{index_name}.faiss")
+def load_vectorstore(index_name, embeddings, variant=FAISS_INDEX_VARIANT, mmap=False):
+    """
+    Load a vector store saved in FAISS_DB_DIR with the given index variant
+
+    :param index_name: Name of the index saved by FAISS.save_local
+    :param embeddings: Embeddings of the queries
+    :param variant: Index variant built by faiss_index.py ("flat" for the saved index)
+    :param mmap: Memory-map the index file
+    :return: FAISS vector store
+    """
+    index = read_index(index_name, variant, mmap=mmap)
+    # The docstore and the ID mapping are shared by all index variants
+    with open(os.path.join(FAISS_DB_DIR, f"{index_name}.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
 
-    if os.path.isfile(faiss_path):
-        embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-        vectorstore = FAISS.load_local(
-            folder_path="faiss_db",
-            index_name=index_name,
-            embeddings=embeddings,
-            allow_dangerous_deserialization=True,
+class RetrieverRegistry:
+    def __init__(self, embedding_model="text-embedding-3-small"):
+        """
+        Constructor for RetrieverRegistry class
+
+        Process-wide cache of the vector stores saved in FAISS_DB_DIR. Each index
+        is loaded once, with its index file memory-mapped, and loaded again only
+        when the modification time of its files changes. All vector stores share
+        one embeddings client.
+
+        :param embedding_model: OpenAI embedding model of the saved indexes
+        """
+        self.embedding_model = embedding_model
+        self._embeddings = None
+        self._vectorstores = dict()  # (index name, variant) -> (mtimes, vectorstore)
+        self._lock = threading.Lock()
+
+    @property
+    def embeddings(self):
+        """Shared embeddings client of the queries"""
+        if self._embeddings is None:
+            self._embeddings = OpenAIEmbeddings(model=self.embedding_model)
+        return self._embeddings
+
+    def get(self, index_name, variant=FAISS_INDEX_VARIANT, k=10):
+        """
+        Method to get a retriever of a saved index
+
+        :param index_name: Name of the index saved by FAISS.save_local
+        :param variant: Index variant built by faiss_index.py
+        :param k: Number of documents to retrieve
+        :return: Retriever, or None if the index does not exist
+        """
+        if not os.path.isfile(get_index_path(index_name)):
+            return None
+
+        paths = (
+            resolve_index_path(index_name, variant),
+            os.path.join(FAISS_DB_DIR, f"{index_name}.pkl"),
         )
-        return vectorstore.as_retriever(search_kwargs={"k": 10})
-    else:
-        return None
+        mtimes = tuple(os.path.getmtime(path) for path in paths)
+
+        with self._lock:
+            cached = self._vectorstores.get((index_name, variant))
+            if cached is not None and cached[0] == mtimes:
+                vectorstore = cached[1]
+            else:
+                vectorstore = load_vectorstore(
+                    index_name, self.embeddings, variant, mmap=True
+                )
+                self._vectorstores[(index_name, variant)] = (mtimes, vectorstore)
+        return vectorstore.as_retriever(search_kwargs={"k": k})
+
+
+# Shared registry of the saved retrievers, kept across Streamlit reruns and sessions
+retriever_registry = RetrieverRegistry()
+
+
+def load_existing_retriever(index_name, variant=FAISS_INDEX_VARIANT):
+    # The index is loaded once per process and shared by every session
+    return retriever_registry.get(index_name, variant, k=10)